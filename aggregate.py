@@ -0,0 +1,291 @@
+import copy
+from abc import ABC, abstractmethod
+from array import array
+from functools import partial
+from typing import Iterable
+import numpy as np
+import data_io as io
+import stats
+import cha_counter
+import sketches
+
+
+# Cha reaction after encoding of prepared messages is fixed
+CHA_REACTION = io.fix_encoding(cha_counter.CHA_REACTION)
+
+
+def merge_counts(obj: dict, other: dict):
+    """
+        Adds (possibly nested) counts of other dictionary to obj.
+    """
+    for key, value in other.items():
+        if isinstance(value, dict):
+            merge_counts(obj.setdefault(key, {}), value)
+        else:
+            stats.add_to_key(obj, key, value)
+
+
+class Metric(ABC):
+    """
+        Base class of metrics that are computed in a single pass over
+        the messages. Subclasses implement add() and result().
+        Partial metrics computed on separate files are combined with merge().
+    """
+    name = None
+
+    @abstractmethod
+    def add(self, message: dict):
+        pass
+
+    def empty(self) -> "Metric":
+        """
+            Returns a new metric with the same parameters and no state.
+        """
+        return type(self)()
+
+    def merge(self, other: "Metric"):
+        merge_counts(self.data, other.data)
+
+    def state(self):
+        """
+            Returns JSON serializable state of the metric.
+        """
+        return self.data
+
+    def load_state(self, state):
+        """
+            Restores the metric from state returned by state().
+        """
+        self.data = state
+
+    @abstractmethod
+    def result(self):
+        pass
+
+
+class MessageCounts(Metric):
+    """
+        Number of messages, photos, videos and calls of each participant
+        together with totals. Same output as stats.number_of_messages.
+    """
+    name = "messages"
+
+    def __init__(self):
+        self.data = {}
+        self.total = {}
+
+    def add(self, message: dict):
+        stats.count_message(self.data, self.total, message)
+
+    def merge(self, other: "MessageCounts"):
+        merge_counts(self.data, other.data)
+        merge_counts(self.total, other.total)
+
+    def state(self) -> dict:
+        return {"data": self.data, "total": self.total}
+
+    def load_state(self, state: dict):
+        self.data = state["data"]
+        self.total = state["total"]
+
+    def result(self) -> dict:
+        return stats.add_totals(copy.deepcopy(self.data), dict(self.total))
+
+
+class ReactionsSent(Metric):
+    """
+        Number of reactions of each type sent by each participant.
+    """
+    name = "reactions_sent"
+
+    def __init__(self):
+        self.data = {}
+
+    def add(self, message: dict):
+        for reaction in message.get("reactions", []):
+            stats.add_to_key(self.data.setdefault(reaction["actor"], {}),
+                             reaction["reaction"], 1)
+
+    def result(self) -> dict:
+        return self.data
+
+
+class ReactionsReceived(Metric):
+    """
+        Number of reactions of each type received by each participant.
+    """
+    name = "reactions_received"
+
+    def __init__(self):
+        self.data = {}
+
+    def add(self, message: dict):
+        for reaction in message.get("reactions", []):
+            stats.add_to_key(self.data.setdefault(message["sender_name"], {}),
+                             reaction["reaction"], 1)
+
+    def result(self) -> dict:
+        return self.data
+
+
+class ChaMatrix(Metric):
+    """
+        Number of cha reactions each participant gave to each other participant.
+        Result is {giver: {receiver: count}}.
+    """
+    name = "cha"
+
+    def __init__(self, reaction: str = CHA_REACTION):
+        self.reaction = reaction
+        self.data = {}
+
+    def empty(self) -> "ChaMatrix":
+        return ChaMatrix(self.reaction)
+
+    def add(self, message: dict):
+        for reaction in message.get("reactions", []):
+            if reaction["reaction"] == self.reaction:
+                stats.add_to_key(self.data.setdefault(reaction["actor"], {}),
+                                 message["sender_name"], 1)
+
+    def result(self) -> dict:
+        return self.data
+
+
+class PeriodCounts(Metric):
+    """
+        Number of messages each participant sent per period.
+        period is in ["day", "month"]. Timestamps are collected as int64
+        and converted to dates in timezone (local if None) in bulk.
+    """
+
+    def __init__(self, period: str = "day", timezone: str = None):
+        if period not in ("day", "month"):
+            raise ValueError(
+                f'Bad period parameter provided: {period}. '
+                f'Please provide one of the valid parameters: [day|month]')
+        self.name = f"messages_per_{period}"
+        self.period = period
+        self.format = "%Y-%m-%d" if period == "day" else "%Y-%m"
+        self.timezone = timezone
+        # Sender name -> timestamps of sent messages
+        self.timestamps = {}
+        # Counts restored with load_state()
+        self.base = {}
+
+    def empty(self) -> "PeriodCounts":
+        return PeriodCounts(self.period, self.timezone)
+
+    def add(self, message: dict):
+        sender = message["sender_name"]
+        if sender not in self.timestamps:
+            self.timestamps[sender] = array("q")
+        self.timestamps[sender].append(message["timestamp_ms"])
+
+    def merge(self, other: "PeriodCounts"):
+        for sender, timestamps in other.timestamps.items():
+            if sender not in self.timestamps:
+                self.timestamps[sender] = array("q")
+            self.timestamps[sender].extend(timestamps)
+
+    def result(self) -> dict:
+        ret_data = copy.deepcopy(self.base)
+        for sender, timestamps in self.timestamps.items():
+            dates = io.truncate_dates(io.to_local_datetime(
+                np.frombuffer(timestamps, dtype=np.int64), self.timezone), self.period)
+            counts = dates.value_counts()
+            merge_counts(ret_data.setdefault(sender, {}),
+                         dict(zip(counts.index.strftime(self.format), counts.tolist())))
+        return {sender: dict(sorted(buckets.items()))
+                for sender, buckets in ret_data.items()}
+
+    def state(self) -> dict:
+        return self.result()
+
+    def load_state(self, state: dict):
+        self.timestamps = {}
+        self.base = state
+
+
+class SketchStats(Metric):
+    """
+        Bounded memory estimates of distinct words, most frequent words,
+        most reacted messages and message length quantiles.
+        Same output as stats.approximate_stats.
+    """
+    name = "sketches"
+
+    def __init__(self):
+        self.sketches = sketches.MessageSketches()
+
+    def add(self, message: dict):
+        self.sketches.add(message)
+
+    def merge(self, other: "SketchStats"):
+        self.sketches.merge(other.sketches)
+
+    def state(self) -> dict:
+        return self.sketches.state()
+
+    def load_state(self, state: dict):
+        self.sketches.load_state(state)
+
+    def result(self) -> dict:
+        return self.sketches.result()
+
+
+def aggregate(messages: Iterable[dict], metrics: list) -> dict:
+    """
+        Feeds each message to every metric in a single pass over messages.
+        Returns results of metrics by their names.
+    """
+    for message in messages:
+        for metric in metrics:
+            metric.add(message)
+
+    return {metric.name: metric.result() for metric in metrics}
+
+
+def aggregate_file(metrics: list, filename: str) -> list:
+    """
+        Feeds messages of a single message_N.json file to metrics.
+        Used to pre-aggregate files in worker processes.
+    """
+    aggregate(io.load_file_messages(filename), metrics)
+    return metrics
+
+
+def default_metrics() -> list:
+    """
+        Returns a new instance of every available metric.
+    """
+    return [MessageCounts(), ReactionsSent(), ReactionsReceived(), ChaMatrix(),
+            PeriodCounts("day"), PeriodCounts("month")]
+
+
+def report(folder_path: str, metrics: list = None,
+           incremental: bool = False, workers: int = 1) -> dict:
+    """
+        Takes in folder_path where the Messenger group chats are stored
+        and computes all metrics (default_metrics if not provided)
+        while parsing the messages only once.
+        With workers other than 1 each file is parsed and aggregated
+        in a worker process and partial results are merged in file order,
+        which gives the same output as the serial path.
+    """
+    if metrics is None:
+        metrics = default_metrics()
+
+    if workers == 1:
+        return aggregate(io.iter_group_messages(folder_path, incremental), metrics)
+
+    # Workers get new empty metrics: work items are pickled lazily, so
+    # passing metrics themselves would send state merged from earlier
+    # files (and state restored with load_state) along with later files.
+    empty_metrics = [metric.empty() for metric in metrics]
+    for partials in io.map_group_files(partial(aggregate_file, empty_metrics),
+                                       folder_path, workers):
+        for metric, partial_metric in zip(metrics, partials):
+            metric.merge(partial_metric)
+
+    return {metric.name: metric.result() for metric in metrics}
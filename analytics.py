@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+import data_io as io
+import rollup
+
+
+def day_counts(index: rollup.RollupIndex, metric: str = "messages",
+               from_date=None, to_date=None) -> tuple:
+    """
+        Returns (days, participants, cumulative) of metric from from_date
+        to to_date (whole index if None), where cumulative is the
+        participant x (days + 1) prefix sum matrix of daily counts.
+        The last row is the "_total" of all participants.
+    """
+    if metric not in rollup.METRICS:
+        raise ValueError(
+            f'Bad metric parameter provided: {metric}. '
+            f'Please provide one of the valid parameters: [{"|".join(rollup.METRICS)}]')
+
+    first_day, last_day = index.day_range(from_date, to_date)
+    days = np.arange(first_day, last_day + 1, dtype="datetime64[D]")
+    positions = index.offsets(np.arange(first_day, last_day + 2, dtype="datetime64[D]"))
+    cumulative = index.cumulative[rollup.METRICS.index(metric)][:, positions]
+    cumulative = np.vstack([cumulative, cumulative.sum(axis=0)])
+
+    return days, index.participants + ["_total"], cumulative
+
+
+def rolling_counts(cumulative: np.ndarray, window: int) -> np.ndarray:
+    """
+        Returns the count of the last window days (fewer at the start)
+        ending on each day, from a prefix sum matrix, in O(n).
+    """
+    ends = np.arange(1, cumulative.shape[1])
+    return cumulative[:, ends] - cumulative[:, np.maximum(ends - window, 0)]
+
+
+def rolling_rates(index: rollup.RollupIndex, metric: str = "messages", windows=(7, 30),
+                  from_date=None, to_date=None) -> pd.DataFrame:
+    """
+        Returns the average daily count of metric over each of the last
+        `windows` days for each participant (and "_total") and day as a
+        participant, date_local, rate_<window>d pd.DataFrame.
+    """
+    days, participants, cumulative = day_counts(index, metric, from_date, to_date)
+
+    df = pd.DataFrame({
+        "participant": np.repeat(participants, len(days)),
+        "date_local": np.tile(days, len(participants)).astype("datetime64[ns]")
+    })
+    for window in windows:
+        df[f"rate_{window}d"] = rolling_counts(cumulative, window).ravel() / window
+
+    return df
+
+
+def longest_runs(flags: np.ndarray) -> tuple:
+    """
+        Returns (start, length) of the longest run of True in each row
+        of flags (start is -1 and length 0 if a row has no True).
+        Runs are found with a single diff over the padded matrix.
+    """
+    padded = np.zeros((flags.shape[0], flags.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = flags
+    edges = np.diff(padded, axis=1)
+    # Row-major order keeps starts and ends of the same run aligned
+    rows, starts = np.nonzero(edges == 1)
+    ends = np.nonzero(edges == -1)[1]
+    lengths = ends - starts
+
+    best_start = np.full(flags.shape[0], -1, dtype=np.int64)
+    best_length = np.zeros(flags.shape[0], dtype=np.int64)
+    bounds = np.searchsorted(rows, np.arange(flags.shape[0] + 1))
+
+    for row in range(flags.shape[0]):
+        low, high = bounds[row], bounds[row + 1]
+        if low < high:
+            best = low + np.argmax(lengths[low:high])
+            best_start[row] = starts[best]
+            best_length[row] = lengths[best]
+
+    return best_start, best_length
+
+
+def runs_frame(days: np.ndarray, participants: list, starts: np.ndarray,
+               lengths: np.ndarray) -> pd.DataFrame:
+    if len(days) == 0:
+        # The index covers no days (e.g. an empty chat)
+        return pd.DataFrame({
+            "participant": pd.Series(dtype=object),
+            "start": pd.Series(dtype="datetime64[ns]"),
+            "end": pd.Series(dtype="datetime64[ns]"),
+            "days": pd.Series(dtype=np.int64)
+        })
+
+    found = starts >= 0
+    start_days = np.where(found, days[np.maximum(starts, 0)], np.datetime64("NaT"))
+    return pd.DataFrame({
+        "participant": participants,
+        "start": start_days.astype("datetime64[ns]"),
+        "end": (start_days + np.maximum(lengths - 1, 0)).astype("datetime64[ns]"),
+        "days": lengths
+    })
+
+
+def longest_streaks(index: rollup.RollupIndex, metric: str = "messages",
+                    from_date=None, to_date=None) -> pd.DataFrame:
+    """
+        Returns the longest streak of consecutive days with at least one
+        metric of each participant (and "_total") as a
+        participant, start, end, days pd.DataFrame.
+    """
+    days, participants, cumulative = day_counts(index, metric, from_date, to_date)
+    starts, lengths = longest_runs(np.diff(cumulative, axis=1) > 0)
+    return runs_frame(days, participants, starts, lengths)
+
+
+def longest_silences(index: rollup.RollupIndex, metric: str = "messages",
+                     from_date=None, to_date=None) -> pd.DataFrame:
+    """
+        Returns the longest run of consecutive days without metric
+        of each participant (and "_total", i.e. the whole chat) as a
+        participant, start, end, days pd.DataFrame.
+    """
+    days, participants, cumulative = day_counts(index, metric, from_date, to_date)
+    starts, lengths = longest_runs(np.diff(cumulative, axis=1) == 0)
+    return runs_frame(days, participants, starts, lengths)
+
+
+def silence_gaps(index: rollup.RollupIndex, metric: str = "messages", min_days: int = 7,
+                 from_date=None, to_date=None) -> pd.DataFrame:
+    """
+        Returns all gaps of at least min_days days in which nobody in
+        the chat had metric, longest first, as a start, end, days pd.DataFrame.
+    """
+    days, _, cumulative = day_counts(index, metric, from_date, to_date)
+    silent = np.zeros(len(days) + 2, dtype=np.int8)
+    silent[1:-1] = np.diff(cumulative[-1]) == 0
+    edges = np.diff(silent)
+    starts = np.nonzero(edges == 1)[0]
+    lengths = np.nonzero(edges == -1)[0] - starts
+
+    keep = lengths >= min_days
+    starts, lengths = starts[keep], lengths[keep]
+    order = np.argsort(-lengths, kind="stable")
+    starts, lengths = starts[order], lengths[order]
+
+    return pd.DataFrame({
+        "start": days[starts].astype("datetime64[ns]"),
+        "end": (days[starts] + lengths - 1).astype("datetime64[ns]"),
+        "days": lengths
+    })
+
+
+def records(df: pd.DataFrame) -> list:
+    """
+        Returns rows of df as a list of dicts with dates as ISO strings.
+    """
+    df = df.copy()
+    for column in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = df[column].dt.strftime("%Y-%m-%d")
+    return df.astype(object).where(df.notna(), None).to_dict("records")
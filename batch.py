@@ -0,0 +1,107 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import aggregate
+import data_io as io
+
+
+def find_conversations(inbox_path: str) -> list:
+    """
+        Takes in inbox_path (e.g. messages/inbox of a Messenger export)
+        and returns all conversation folders containing *.json files,
+        largest (by total size of *.json files) first.
+    """
+    conversations = []
+    for entry in os.scandir(inbox_path):
+        if not entry.is_dir():
+            continue
+        size = sum(os.path.getsize(file_name)
+                   for file_name in io.group_files(entry.path))
+        if size:
+            conversations.append((size, entry.path))
+
+    conversations.sort(key=lambda conversation: (-conversation[0], conversation[1]))
+    return [folder_path for _, folder_path in conversations]
+
+
+def process_conversation(folder_path: str) -> tuple:
+    """
+        Computes all stats of a single conversation.
+        Returns (folder_path, report, number of messages, elapsed seconds).
+    """
+    start = time.perf_counter()
+    report = aggregate.report(folder_path)
+    num_messages = report["messages"].get("_total", {}).get("messages", 0)
+    return folder_path, report, num_messages, time.perf_counter() - start
+
+
+def process_inbox(inbox_path: str, output_path: str, workers: int = None) -> dict:
+    """
+        Computes stats of every conversation under inbox_path on a pool of
+        worker processes. Writes a <conversation>.json file per conversation
+        and a consolidated inbox_stats.json to output_path. Conversations
+        that fail are reported and skipped.
+    """
+    conversations = find_conversations(inbox_path)
+    print(f"Found {len(conversations)} conversations in {inbox_path}")
+    os.makedirs(output_path, exist_ok=True)
+
+    reports = {}
+    # Conversation name -> error of conversations that could not be processed
+    failures = {}
+    total_messages = 0
+    start = time.perf_counter()
+
+    # Largest conversations are submitted first so they do not finish last.
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(process_conversation, folder_path): folder_path
+                   for folder_path in conversations}
+        for future in as_completed(futures):
+            name = os.path.basename(os.path.normpath(futures[future]))
+            try:
+                folder_path, report, num_messages, elapsed = future.result()
+            except Exception as error:
+                # One broken conversation must not abort the whole inbox
+                failures[name] = f"{type(error).__name__}: {error}"
+                print(f"{name}: failed ({futures[future]}): {failures[name]}")
+                continue
+            io.dump_json(report, os.path.join(output_path, f"{name}.json"))
+            reports[name] = report
+            total_messages += num_messages
+            print(f"{name}: {num_messages} messages in {elapsed:.2f}s "
+                  f"({num_messages / max(elapsed, 1e-9):.0f} messages/s)")
+
+    elapsed = time.perf_counter() - start
+    io.dump_json({name: reports[name] for name in sorted(reports)},
+                 os.path.join(output_path, "inbox_stats.json"))
+
+    print(f"Processed {total_messages} messages from {len(reports)} conversations "
+          f"in {elapsed:.2f}s ({total_messages / max(elapsed, 1e-9):.0f} messages/s)")
+    if failures:
+        print(f"Failed to process {len(failures)} conversations:")
+        for name in sorted(failures):
+            print(f"\t{name}: {failures[name]}")
+
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Computes stats for every conversation of a Messenger inbox.")
+    parser.add_argument("inbox", help="path to the messages/inbox folder")
+    parser.add_argument("-o", "--output", default="inbox_stats",
+                        help="folder where stats are written")
+    parser.add_argument("-w", "--workers", type=int, default=0,
+                        help="number of worker processes (0 uses all cores)")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.inbox):
+        sys.exit('Provided inbox path does not exist.')
+
+    process_inbox(args.inbox, args.output, args.workers or None)
+
+
+if __name__ == "__main__":
+    main()
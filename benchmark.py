@@ -0,0 +1,337 @@
+import argparse
+import gc
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from functools import partial
+import numpy as np
+import pandas as pd
+import cha_counter
+import data_io as io
+import plot
+import stats
+import synthetic
+
+
+def make_grouping_input(num_days: int, num_participants: int, seed: int = 0) -> pd.DataFrame:
+    """
+        Builds a synthetic DataFrame shaped like the output of
+        plot.prepare_data_for_messages_per_period, covering num_days
+        days and num_participants participants.
+    """
+    rng = np.random.default_rng(seed)
+    num_rows = num_days * num_participants * 2
+    start = pd.Timestamp(2012, 1, 1)
+    return pd.DataFrame({
+        "sender_name": rng.integers(num_participants, size=num_rows).astype(str),
+        "date_local": start + pd.to_timedelta(rng.integers(num_days, size=num_rows), unit="D")
+    })
+
+
+def benchmark_gap_filling(spans=(365, 4 * 365, 8 * 365), participants=(5, 20, 40)):
+    """
+        Prints the runtime of plot.group_data_per_period for each
+        combination of date span (in days) and participant count.
+    """
+    print("days,participants,rows_out,daily_s,monthly_s")
+    for num_days in spans:
+        for num_participants in participants:
+            df = make_grouping_input(num_days, num_participants)
+
+            start = time.perf_counter()
+            df1 = plot.group_data_per_period(
+                df, "sender_name", None, None, period_days=1, period_months=0)
+            daily = time.perf_counter() - start
+
+            df["date_local"] = io.truncate_dates(df["date_local"], "month")
+            start = time.perf_counter()
+            plot.group_data_per_period(
+                df, "sender_name", None, None, period_days=0, period_months=1)
+            monthly = time.perf_counter() - start
+
+            print(f"{num_days},{num_participants},{len(df1.index)},{daily:.4f},{monthly:.4f}")
+
+
+def make_decoding_input(num_messages: int, num_participants: int = 40, seed: int = 0) -> list:
+    """
+        Builds num_messages synthetic raw Messenger messages with
+        iso-8859-1 escaped sender names, reactions and content.
+    """
+    rng = np.random.default_rng(seed)
+    names = [f"Dalyvis {i} \u017e\u0105\u010d".encode("utf-8").decode("iso-8859-1")
+             for i in range(num_participants)]
+    reactions = [r.encode("utf-8").decode("iso-8859-1") for r in "\U0001F606\u2764\U0001F44D"]
+    contents = [c.encode("utf-8").decode("iso-8859-1") for c in ["labas", "ok \u0105\u010d\u0119", "cha cha"]]
+
+    senders = rng.integers(num_participants, size=num_messages)
+    actors = rng.integers(num_participants, size=num_messages)
+    kinds = rng.integers(len(reactions), size=num_messages)
+    texts = rng.integers(len(contents), size=num_messages)
+    return [{
+        "sender_name": names[senders[i]],
+        "timestamp_ms": 1325376000000 + 60000 * i,
+        "type": "Generic",
+        "content": contents[texts[i]] + str(i % 100),
+        "reactions": [{"actor": names[actors[i]], "reaction": reactions[kinds[i]]}]
+    } for i in range(num_messages)]
+
+
+def benchmark_decoding(num_messages: int = 1000000):
+    """
+        Compares per-row decoding of names, reactions and content
+        with the memoized data_io decoders.
+    """
+    messages = make_decoding_input(num_messages)
+
+    start = time.perf_counter()
+    for message in messages:
+        bytes(message["sender_name"], 'iso-8859-1').decode('utf-8')
+        bytes(message["content"], 'iso-8859-1').decode('utf-8')
+        for reaction in message["reactions"]:
+            bytes(reaction["actor"], 'iso-8859-1').decode('utf-8')
+            bytes(reaction["reaction"], 'iso-8859-1').decode('utf-8')
+    per_row = time.perf_counter() - start
+
+    io.fix_encoding.cache_clear()
+    io.fix_content_encoding.cache_clear()
+    start = time.perf_counter()
+    for message in messages:
+        io.fix_encoding(message["sender_name"])
+        io.fix_content_encoding(message["content"])
+        for reaction in message["reactions"]:
+            io.fix_encoding(reaction["actor"])
+            io.fix_encoding(reaction["reaction"])
+    memoized = time.perf_counter() - start
+
+    print("messages,per_row_s,memoized_s")
+    print(f"{num_messages},{per_row:.4f},{memoized:.4f}")
+
+
+def retained_memory(build) -> tuple:
+    """
+        Returns (retained bytes, peak bytes) allocated by build().
+    """
+    io.fix_encoding.cache_clear()
+    io.fix_content_encoding.cache_clear()
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current, peak
+
+
+def benchmark_memory(num_messages: int = 200000):
+    """
+        Compares memory held by prepared messages as a list of dicts
+        with the same messages in a data_io.MessageTable.
+    """
+    text = json.dumps({"messages": make_decoding_input(num_messages)})
+
+    dicts, dicts_peak = retained_memory(
+        lambda: [io.prepare_message(message) for message in json.loads(text)["messages"]])
+    table, table_peak = retained_memory(
+        lambda: io.MessageTable.from_messages(
+            io.prepare_message(message) for message in json.loads(text)["messages"]))
+
+    print("messages,dicts_mb,table_mb,dicts_peak_mb,table_peak_mb")
+    print(f"{num_messages},{dicts / 2**20:.1f},{table / 2**20:.1f},"
+          f"{dicts_peak / 2**20:.1f},{table_peak / 2**20:.1f}")
+
+
+def time_command(command: list, repeat: int) -> float:
+    """
+        Returns the best wall clock time of running command repeat times.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark_startup(repeat: int = 5):
+    """
+        Prints the start-up time of each main.py subcommand, i.e. the time
+        to import the modules it needs, next to a bare interpreter.
+    """
+    bare = time_command([sys.executable, "-c", "pass"], repeat)
+
+    print("subcommand,startup_s,imports_s")
+    print(f"python,{bare:.4f},0.0000")
+    for name in ["messages", "reactions", "sketch", "cha", "plot", "search", "analytics", "sessions"]:
+        startup = time_command([sys.executable, "-c",
+                                f"import main; main.import_subcommand('{name}')"], repeat)
+        print(f"{name},{startup:.4f},{startup - bare:.4f}")
+
+
+def result_digest(result) -> str:
+    """
+        Returns a short digest of the result of a stage, used to
+        check that optimizations do not change results.
+    """
+    if isinstance(result, pd.DataFrame):
+        text = result.to_csv(index=False)
+    elif isinstance(result, io.MessageTable):
+        text = json.dumps([result.names, list(result.sender), list(result.timestamp_ms)])
+    else:
+        text = json.dumps(result, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def run_stage(stages: dict, name: str, function, *args):
+    """
+        Runs function(*args), records its time, peak traced memory,
+        number of rows and result digest in stages[name] and returns its result.
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    stages[name] = {
+        "seconds": round(seconds, 4),
+        "peak_mb": round(peak / 2**20, 2),
+        "rows": len(result),
+        "result": result_digest(result)
+    }
+    return result
+
+
+def count_reactions(folder_path: str) -> list:
+    """
+        Counts all reactions as cha_counter.py --all-reactions does and
+        returns the (reaction, giver, receiver, count) rows.
+    """
+    counter = cha_counter.ReactionCounter()
+    for file_counter in io.map_group_files(
+            partial(cha_counter.count_file, counter_class=cha_counter.ReactionCounter),
+            folder_path):
+        counter.merge(file_counter)
+    return sorted(counter.rows())
+
+
+def messages_per_period(messages: list, period: str) -> pd.DataFrame:
+    """
+        Groups messages per UTC day or month with gaps filled, as plot.py does.
+    """
+    df = pd.DataFrame({
+        "sender_name": [message["sender_name"] for message in messages],
+        "timestamp_ms": [message["timestamp_ms"] for message in messages]
+    })
+    df["date_local"] = io.truncate_dates(io.to_local_datetime(df.pop("timestamp_ms"), "UTC"),
+                                         period)
+    return plot.group_data_per_period(df, "sender_name", None, None,
+                                      period_days=int(period == "day"),
+                                      period_months=int(period == "month"))
+
+
+def benchmark_suite(folder_path: str) -> dict:
+    """
+        Runs the main stages of the project on the export in folder_path
+        and returns time (s), peak traced memory (MB), number of rows and
+        result digest of each stage.
+        Times include the overhead of tracing memory allocations.
+    """
+    stages = {}
+
+    messages = run_stage(stages, "load_group_messages", io.load_group_messages, folder_path)
+    run_stage(stages, "number_of_messages", stats.number_of_messages, messages)
+    table = run_stage(stages, "load_group_table", io.load_group_table, folder_path)
+    run_stage(stages, "number_of_messages_table", stats.number_of_messages_table, table)
+    run_stage(stages, "cha_counter", count_reactions, folder_path)
+    run_stage(stages, "group_messages_per_day", messages_per_period, messages, "day")
+    run_stage(stages, "group_messages_per_month", messages_per_period, messages, "month")
+
+    return stages
+
+
+def compare_with_baseline(report: dict, baseline: dict) -> bool:
+    """
+        Prints stages of report next to baseline.
+        Returns False if a stage result differs from the baseline.
+    """
+    same = True
+    print("stage,seconds,baseline_s,ratio,peak_mb,baseline_peak_mb,result")
+
+    for name, stage in report["stages"].items():
+        base = baseline["stages"].get(name)
+        if base is None:
+            print(f"{name},{stage['seconds']:.4f},,,{stage['peak_mb']:.2f},,new")
+            continue
+
+        result = "ok" if stage["result"] == base["result"] else "CHANGED"
+        same = same and result == "ok"
+        ratio = stage["seconds"] / base["seconds"] if base["seconds"] else float("nan")
+        print(f"{name},{stage['seconds']:.4f},{base['seconds']:.4f},{ratio:.2f},"
+              f"{stage['peak_mb']:.2f},{base['peak_mb']:.2f},{result}")
+
+    return same
+
+
+def run_suite(args: argparse.Namespace) -> bool:
+    """
+        Generates the synthetic export described by args, runs the
+        suite on it and compares the report with the baseline file.
+    """
+    export = {"num_participants": args.participants, "num_messages": args.messages,
+              "years": args.years, "seed": args.seed}
+
+    with tempfile.TemporaryDirectory() as folder_path:
+        synthetic.generate_export(folder_path, **export)
+        report = {"export": export, "stages": benchmark_suite(folder_path)}
+
+    if args.save_baseline or not os.path.isfile(args.baseline):
+        io.dump_json(report, args.baseline)
+        print(f"Baseline saved to:\n\t{args.baseline}")
+
+    baseline = io.load_json(args.baseline)
+    if baseline["export"] != export:
+        print("Baseline was recorded on another export, results are not comparable.")
+    return compare_with_baseline(report, baseline)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="facebook-stats benchmarks.")
+    parser.add_argument("--startup", action="store_true",
+                        help="only benchmark the start-up time of each main.py subcommand")
+    parser.add_argument("--suite", action="store_true",
+                        help="benchmark the main stages on a synthetic export against a baseline")
+    parser.add_argument("-p", "--participants", type=int, default=20)
+    parser.add_argument("-m", "--messages", type=int, default=100000)
+    parser.add_argument("-y", "--years", type=float, default=4)
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument("-b", "--baseline", default="benchmark_baseline.json",
+                        help="baseline file (created if it does not exist)")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="replace the baseline with this run")
+    args = parser.parse_args()
+
+    if args.startup:
+        benchmark_startup()
+        return
+
+    if args.suite:
+        if not run_suite(args):
+            sys.exit("Results differ from the baseline.")
+        return
+
+    benchmark_gap_filling()
+    benchmark_decoding()
+    benchmark_memory()
+    benchmark_startup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+import data_io as io
+import instrument
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "facebook-stats")
+
+# Bumped whenever the layout or content of cached tables changes.
+CACHE_VERSION = 3
+
+MESSAGE_COLUMNS = {
+    "sender_name": "category",
+    "timestamp_ms": "int64",
+    "type": "category",
+    "is_unsent": "bool",
+    "content": "object",
+    "fingerprint": "uint64"
+}
+
+REACTION_COLUMNS = {
+    "actor": "category",
+    "sender_name": "category",
+    "reaction": "category",
+    "timestamp_ms": "int64",
+    # Row of the reacted message in the messages table
+    "message": "int64"
+}
+
+
+def folder_cache_dir(folder_path: str, cache_dir: str = None) -> str:
+    """
+        Returns the directory where cached tables of folder_path are stored.
+    """
+    key = hashlib.sha1(os.path.abspath(folder_path).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir or CACHE_DIR, key)
+
+
+def file_stats(file_name: str) -> dict:
+    """
+        Returns size and modification time of file_name, which tell
+        whether it changed since its cached data was written.
+    """
+    stat = os.stat(file_name)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def source_manifest(file_names: list) -> dict:
+    """
+        Returns file_stats of each file by its base name.
+    """
+    return {os.path.basename(file_name): file_stats(file_name) for file_name in file_names}
+
+
+def sources_unchanged(derived_file: str, file_names: list) -> bool:
+    """
+        Returns True if derived_file (e.g. an index built from file_names)
+        exists and was built from exactly these files with the same sizes
+        and modification times, as recorded by record_sources.
+        Added, deleted and replaced files all make it stale.
+    """
+    sources_file = f"{derived_file}.sources.json"
+    if not (os.path.isfile(derived_file) and os.path.isfile(sources_file)):
+        return False
+    try:
+        return io.load_json(sources_file) == source_manifest(file_names)
+    except ValueError:
+        return False
+
+
+def record_sources(derived_file: str, manifest: dict):
+    """
+        Records the source_manifest derived_file was built from.
+    """
+    io.dump_json(manifest, f"{derived_file}.sources.json")
+
+
+def parse_file(filename: str) -> tuple:
+    """
+        Parses a single message_N.json file into typed messages
+        and reactions tables.
+    """
+    messages = {column: [] for column in MESSAGE_COLUMNS}
+    reactions = {column: [] for column in REACTION_COLUMNS}
+    file_messages = io.read_json(filename)["messages"]
+
+    with instrument.stage("decode", len(file_messages)):
+        for row, message in enumerate(file_messages):
+            sender_name = io.fix_encoding(message["sender_name"])
+            content = message.get("content")
+            if content is not None:
+                content = io.fix_content_encoding(content)
+            messages["sender_name"].append(sender_name)
+            messages["timestamp_ms"].append(message["timestamp_ms"])
+            messages["type"].append(message.get("type", "Generic"))
+            messages["is_unsent"].append(message.get("is_unsent", False))
+            messages["content"].append(content)
+            messages["fingerprint"].append(io.message_fingerprint({
+                "sender_name": sender_name,
+                "timestamp_ms": message["timestamp_ms"],
+                "content": "" if content is None else content}))
+
+            for reaction in message.get("reactions", []):
+                reactions["actor"].append(io.fix_encoding(reaction["actor"]))
+                reactions["sender_name"].append(sender_name)
+                reactions["reaction"].append(io.fix_encoding(reaction["reaction"]))
+                reactions["timestamp_ms"].append(message["timestamp_ms"])
+                reactions["message"].append(row)
+
+    with instrument.stage("build_dataframe", len(file_messages)):
+        return (pd.DataFrame(messages).astype(MESSAGE_COLUMNS),
+                pd.DataFrame(reactions).astype(REACTION_COLUMNS))
+
+
+def select_columns(types: dict, columns: list = None) -> dict:
+    """
+        Returns column types of the selected columns (all if None).
+    """
+    if columns is None:
+        return types
+    return {column: types[column] for column in columns}
+
+
+def concat_tables(tables: list, columns: dict) -> pd.DataFrame:
+    """
+        Concatenates per-file tables and restores column types,
+        since categories of different files do not have to match.
+    """
+    if not tables:
+        return pd.DataFrame({column: [] for column in columns}).astype(columns)
+    return pd.concat(tables, ignore_index=True).astype(columns)
+
+
+def combine_tables(messages: list, reactions: list,
+                   message_columns: list = None, reaction_columns: list = None) -> tuple:
+    """
+        Concatenates per-file messages and reactions tables and drops
+        duplicate messages (equal fingerprints) together with their reactions.
+        The number of dropped messages is stored in
+        messages.attrs["dropped_duplicates"].
+        Only message_columns/reaction_columns (all if None) are returned.
+    """
+    # Make reaction message rows point into the concatenated messages table.
+    offset = 0
+    for file_messages, file_reactions in zip(messages, reactions):
+        file_reactions["message"] += offset
+        offset += len(file_messages.index)
+
+    messages = concat_tables(messages, select_columns(
+        MESSAGE_COLUMNS, read_columns(message_columns, "fingerprint")))
+    reactions = concat_tables(reactions, select_columns(
+        REACTION_COLUMNS, read_columns(reaction_columns, "message")))
+
+    duplicated = messages["fingerprint"].duplicated().to_numpy()
+    new_rows = np.cumsum(~duplicated) - 1
+    reaction_rows = reactions["message"].to_numpy()
+
+    reactions = reactions[~duplicated[reaction_rows]].reset_index(drop=True)
+    reactions["message"] = new_rows[reactions["message"].to_numpy()]
+    messages = messages[~duplicated].reset_index(drop=True)
+    dropped = int(duplicated.sum())
+
+    if message_columns is not None:
+        messages = messages[list(message_columns)]
+    if reaction_columns is not None:
+        reactions = reactions[list(reaction_columns)]
+    messages.attrs["dropped_duplicates"] = dropped
+
+    return messages, reactions
+
+
+def read_columns(columns: list, required: str) -> list:
+    """
+        Returns columns that have to be read to return columns
+        (all if None), as the required column is always needed.
+    """
+    if columns is None:
+        return None
+    return list(dict.fromkeys([*columns, required]))
+
+
+def load_tables(folder_path: str, cache_dir: str = None,
+                message_columns: list = None, reaction_columns: list = None) -> tuple:
+    """
+        Takes in folder_path where the Messenger group chats are stored
+        and returns (messages, reactions) tables of the group.
+        Parsed files are cached in a columnar Parquet format and
+        only files whose size or modification time changed are re-parsed.
+        Only message_columns/reaction_columns (all if None) are read
+        from the cache. Duplicate messages are dropped (see combine_tables).
+    """
+    if pyarrow is None:
+        print("pyarrow is not installed, parsing data without cache...")
+        parsed = [parse_file(file_name) for file_name in io.group_files(folder_path)]
+        with instrument.stage("combine_tables"):
+            return combine_tables([p[0] for p in parsed], [p[1] for p in parsed],
+                                  message_columns, reaction_columns)
+
+    directory = folder_cache_dir(folder_path, cache_dir)
+    os.makedirs(directory, exist_ok=True)
+    manifest_file = os.path.join(directory, "manifest.json")
+
+    try:
+        manifest = io.load_json(manifest_file) if os.path.isfile(manifest_file) else {}
+    except ValueError:
+        manifest = {}
+
+    message_read = read_columns(message_columns, "fingerprint")
+    reaction_read = read_columns(reaction_columns, "message")
+    messages = []
+    reactions = []
+    new_manifest = {}
+
+    for file_name in io.group_files(folder_path):
+        name = os.path.basename(file_name)
+        entry = {**file_stats(file_name), "version": CACHE_VERSION}
+        messages_file = os.path.join(directory, f"{name}.messages.parquet")
+        reactions_file = os.path.join(directory, f"{name}.reactions.parquet")
+
+        if (manifest.get(name) == entry and os.path.isfile(messages_file)
+                and os.path.isfile(reactions_file)):
+            with instrument.stage("read_cache") as stage:
+                messages.append(pd.read_parquet(messages_file, columns=message_read))
+                reactions.append(pd.read_parquet(reactions_file, columns=reaction_read))
+                stage.rows_out = len(messages[-1].index)
+        else:
+            print(f"Parsing {file_name}...")
+            file_messages, file_reactions = parse_file(file_name)
+            with instrument.stage("write_cache", len(file_messages.index)):
+                file_messages.to_parquet(messages_file, index=False)
+                file_reactions.to_parquet(reactions_file, index=False)
+            messages.append(file_messages if message_read is None
+                            else file_messages[message_read])
+            reactions.append(file_reactions if reaction_read is None
+                             else file_reactions[reaction_read])
+
+        new_manifest[name] = entry
+
+    # Remove cached tables of files that no longer exist.
+    for name in manifest:
+        if name not in new_manifest:
+            for suffix in ("messages", "reactions"):
+                cached_file = os.path.join(directory, f"{name}.{suffix}.parquet")
+                if os.path.isfile(cached_file):
+                    os.remove(cached_file)
+
+    io.dump_json(new_manifest, manifest_file)
+
+    with instrument.stage("combine_tables"):
+        return combine_tables(messages, reactions, message_columns, reaction_columns)
+
+
+def load_messages(folder_path: str, cache_dir: str = None,
+                  columns: list = None) -> pd.DataFrame:
+    """
+        Returns the messages table of the group stored in folder_path
+        with only the given columns (all if None).
+    """
+    return load_tables(folder_path, cache_dir, message_columns=columns,
+                       reaction_columns=[])[0]
+
+
+def load_reactions(folder_path: str, switch: str, cache_dir: str = None) -> pd.DataFrame:
+    """
+        Returns reactions of the group stored in folder_path with a
+        `participant` column holding the actor (switch == "sent") or
+        the message sender (switch == "received").
+    """
+    reactions = load_tables(folder_path, cache_dir, message_columns=[],
+                            reaction_columns=["actor", "sender_name", "reaction", "timestamp_ms"])[1]
+    if switch == "sent":
+        participant = reactions["actor"]
+    elif switch == "received":
+        participant = reactions["sender_name"]
+    else:
+        raise ValueError(
+            f'Bad switch parameter provided: {switch}. '
+            f'Please provide one of the valid parameters: [sent|received]')
+
+    return pd.DataFrame({
+        "participant": participant,
+        "reaction": reactions["reaction"],
+        "timestamp_ms": reactions["timestamp_ms"]
+    })
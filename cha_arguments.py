@@ -0,0 +1,17 @@
+import argparse
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """
+        Adds cha counter arguments to parser. Kept apart from cha_counter,
+        so main.py can add them without importing numpy.
+    """
+    parser.add_argument("path", help="relative path to the specific chat folder")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="number of worker processes parsing *.json files (0 uses all cores)")
+    parser.add_argument("-a", "--all-reactions", action="store_true",
+                        help="count every reaction type and write a reaction,giver,receiver,count table")
+    parser.add_argument("--parquet", action="store_true",
+                        help="write the --all-reactions table in Parquet format")
+    parser.add_argument("--prefetch", type=int, default=0,
+                        help="number of *.json files read ahead on I/O threads (with 1 worker)")
@@ -1,158 +1,297 @@
 from os import path
-import json
+import argparse
 import codecs
 import sys
-from glob import glob
-
-
-def inGroup(group, name):
-    for person in group:
-        if person.name == name:
-            return True
-    return False
-
-
-def findIndex(group, name):
-    for idx, person in enumerate(group):
-        if person.name == name:
-            return idx
-    return None
-
-
-class Person():
-    def __init__(self, name):
-        self.name = name
-        # Number of given chas to each participant will be stored in this dictionary
-        self.gaveCha = {}
-        # Number of received chas from each participant will be stored in this dictionary
-        self.receivedCha = {}
-        self.numMessages = 0
-        self.numReceivedCha = 0
-        self.numGivenCha = 0
-
-    def return_basic_data(self):
-        return "{}\n{}\n{}\n{}\n".format(self.name, self.numMessages,  self.numGivenCha, self.numReceivedCha)
-
-    def return_csv(self):
-        return_str = "{},{},{},{}".format(
-            self.name, self.numMessages, self.numReceivedCha, self.numGivenCha)
-
-        return_str += ",|"
-
-        for item in sorted(self.receivedCha.items()):
-            return_str += ",{}".format(item[1])
-
-        return_str += ",|"
-
-        for item in sorted(self.gaveCha.items()):
-            return_str += ",{}".format(item[1])
-
-        return_str += "\n"
-
-        return return_str
-
-    def print_data(self):
-        print("Name: {}\nNumber of sent messages: {}\nNum of received chas: {}\nNumber of given chas:{}\n".format(
-            self.name, self.numMessages, self.numReceivedCha, self.numGivenCha))
-
-        print("Received chas from participants:")
-        for item in sorted(self.receivedCha.items()):
-            print("{}: {}".format(item[0], item[1]))
-
-        print("\nGiven chas to participants:")
-        for item in sorted(self.gaveCha.items()):
-            print("{}: {}".format(item[0], item[1]))
-        print("\n------------------------------------------")
-
-
-def main():
-    # Check if path argument is provided
-    if len(sys.argv) < 2:
-        sys.exit(
-            'Too few arguments provided.\nCommand exmaple:\n\tpython3 cha_counter.py <relative path to the specific chat folder>')
-
-    file_path = sys.argv[1]
+from functools import partial
+import numpy as np
+import data_io as io
+import instrument
+from cha_arguments import add_arguments
+
+
+# Unicode for cha reaction
+CHA_REACTION = u"\u00f0\u009f\u0098\u0086"
+
+
+class ReactionCounter():
+    def __init__(self, reactions: list = None):
+        # Participant name -> giver/receiver index in the arrays below
+        self.index = {}
+        self.names = []
+        # Reaction -> reaction index in the arrays below
+        self.reaction_index = {}
+        self.reactions = []
+        # When reactions are given only those are counted
+        self.fixed_reactions = reactions is not None
+        # Number of sent messages of each participant
+        self.numMessages = np.zeros(0, dtype=np.int64)
+        # counts[reaction, giver, receiver] is the number of reactions giver gave to receiver
+        self.counts = np.zeros((0, 0, 0), dtype=np.int64)
+
+        if reactions:
+            self.add_reactions(reactions)
+
+    def resize(self):
+        """
+            Grows the count arrays to the number of registered
+            participants and reactions.
+        """
+        num_reactions, num_names = len(self.reactions), len(self.names)
+        grow_reactions = num_reactions - self.counts.shape[0]
+        grow_names = num_names - self.counts.shape[1]
+        if grow_reactions or grow_names:
+            self.numMessages = np.pad(self.numMessages, (0, grow_names))
+            self.counts = np.pad(
+                self.counts, ((0, grow_reactions), (0, grow_names), (0, grow_names)))
+
+    def add_participants(self, names: list) -> list:
+        """
+            Registers new participants and returns indexes of all names.
+        """
+        for name in names:
+            if name not in self.index:
+                self.index[name] = len(self.names)
+                self.names.append(name)
+        self.resize()
+
+        return [self.index[name] for name in names]
+
+    def add_reactions(self, reactions: list) -> list:
+        """
+            Registers new reactions and returns indexes of all reactions.
+        """
+        for reaction in reactions:
+            if reaction not in self.reaction_index:
+                self.reaction_index[reaction] = len(self.reactions)
+                self.reactions.append(reaction)
+        self.resize()
+
+        return [self.reaction_index[reaction] for reaction in reactions]
+
+    def count(self, data: dict):
+        """
+            Counts sent messages and reactions between participants in
+            the contents of a single *.json file.
+        """
+        # Register participants of the file
+        self.add_participants([person["name"] for person in data["participants"]])
+        with instrument.stage("decode", len(data["messages"])):
+            table = io.MessageTable.from_messages(data["messages"])
+        self.count_table(table)
+
+    def count_table(self, table: io.MessageTable):
+        """
+            Counts sent messages and reactions between registered
+            participants in table. Messages and reactions of other
+            participants are skipped.
+        """
+        with instrument.stage("count_reactions", len(table.reaction)) as stage:
+            # Table name id -> participant index (-1 if not a participant)
+            name_map = np.array([self.index.get(name, -1) for name in table.names],
+                                dtype=np.int64)
+            senders = name_map[np.frombuffer(table.sender, dtype=np.uint32)]
+
+            # Reactions to messages of participants
+            receivers = senders[np.frombuffer(table.reaction_message, dtype=np.uint32)]
+            valid = receivers >= 0
+            receivers = receivers[valid]
+            givers = name_map[np.frombuffer(table.reaction_actor, dtype=np.uint32)[valid]]
+            kinds = np.frombuffer(table.reaction, dtype=np.uint32)[valid]
+
+            if not self.fixed_reactions:
+                # New reactions are registered in order of appearance
+                _, first = np.unique(kinds, return_index=True)
+                self.add_reactions([table.reaction_names[kinds[i]] for i in np.sort(first)])
+
+            # Table reaction id -> reaction index (-1 if not counted)
+            kind_map = np.array([self.reaction_index.get(reaction, -1)
+                                 for reaction in table.reaction_names], dtype=np.int64)
+            kinds = kind_map[kinds]
+
+            # Actor gives a reaction to a sender
+            valid = (kinds >= 0) & (givers >= 0)
+
+            # Increment the sent messages and reaction counters
+            self.numMessages += np.bincount(senders[senders >= 0], minlength=len(self.names))
+            np.add.at(self.counts, (kinds[valid], givers[valid], receivers[valid]), 1)
+            stage.rows_out = int(valid.sum())
+
+    def merge(self, other: "ReactionCounter"):
+        """
+            Adds counts of other counter to this one.
+        """
+        indexes = self.add_participants(other.names)
+        reaction_indexes = self.add_reactions(other.reactions)
+        self.numMessages[indexes] += other.numMessages
+        self.counts[np.ix_(reaction_indexes, indexes, indexes)] += other.counts
+
+    def matrix(self, reaction: str) -> np.ndarray:
+        """
+            Returns giver x receiver counts of a single reaction
+            (rows and columns are ordered as self.names).
+        """
+        if reaction not in self.reaction_index:
+            return np.zeros((len(self.names), len(self.names)), dtype=np.int64)
+        return self.counts[self.reaction_index[reaction]]
+
+    def given(self, reaction: str = None) -> dict:
+        """
+            Returns the number of reactions (of every type if reaction
+            is not provided) each participant gave.
+        """
+        counts = self.counts.sum(axis=0) if reaction is None else self.matrix(reaction)
+        return dict(zip(self.names, counts.sum(axis=1).tolist()))
+
+    def received(self, reaction: str = None) -> dict:
+        """
+            Returns the number of reactions (of every type if reaction
+            is not provided) each participant received.
+        """
+        counts = self.counts.sum(axis=0) if reaction is None else self.matrix(reaction)
+        return dict(zip(self.names, counts.sum(axis=0).tolist()))
+
+    def totals(self) -> dict:
+        """
+            Returns the total number of each reaction.
+        """
+        return dict(zip(self.reactions, self.counts.sum(axis=(1, 2)).tolist()))
+
+    def rows(self):
+        """
+            Yields (reaction, giver, receiver, count) for each non zero count.
+        """
+        for kindIndex, giverIndex, receiverIndex in zip(*np.nonzero(self.counts)):
+            yield (self.reactions[kindIndex], self.names[giverIndex],
+                   self.names[receiverIndex],
+                   int(self.counts[kindIndex, giverIndex, receiverIndex]))
+
+    def write_csv(self, file_name: str):
+        """
+            Writes non zero counts to file_name in
+            reaction,giver,receiver,count format.
+        """
+        file = codecs.open(file_name, "w", "iso-8859-1")
+        file.write("Reaction,Giver,Receiver,Count\n")
+        for row in self.rows():
+            file.write("{},{},{},{}\n".format(*row))
+        file.close()
+
+    def write_parquet(self, file_name: str):
+        """
+            Writes non zero counts to file_name in Parquet format.
+            Reactions and names are stored in utf-8.
+        """
+        import pandas as pd
+
+        df = pd.DataFrame(list(self.rows()),
+                          columns=["reaction", "giver", "receiver", "count"])
+        for column in ["reaction", "giver", "receiver"]:
+            df[column] = df[column].map(io.fix_encoding).astype("category")
+        df.to_parquet(file_name, index=False)
+
+
+class ChaCounter(ReactionCounter):
+    def __init__(self):
+        super().__init__([CHA_REACTION])
+
+    @property
+    def cha(self) -> np.ndarray:
+        # cha[giver, receiver] is the number of chas giver gave to receiver
+        return self.counts[0]
+
+    def write_csv(self, file_name: str):
+        """
+            Writes stats of each participant (sorted by name) to file_name.
+        """
+        order = sorted(range(len(self.names)), key=self.names.__getitem__)
+        names = [self.names[i] for i in order]
+        numMessages = self.numMessages[order]
+        cha = self.cha[np.ix_(order, order)]
+        received = cha.T
+        numReceivedCha = received.sum(axis=1)
+        numGivenCha = cha.sum(axis=1)
+
+        file = codecs.open(file_name, "w", "iso-8859-1")
+
+        # Constructing and writing header
+        header_line = "Participant name,Number of sent messages,Number of received chas,Number of sent chas,|Received chas from"
+        header_line += "".join(",{}".format(name) for name in names)
+        header_line += ",|Sent chas to"
+        header_line += "".join(",{}".format(name) for name in names)
+        header_line += "\n"
+        file.write(header_line)
+
+        # Writing data
+        for i, name in enumerate(names):
+            line = "{},{},{},{},|".format(
+                name, numMessages[i], numReceivedCha[i], numGivenCha[i])
+            line += "".join(",{}".format(count) for count in received[i])
+            line += ",|"
+            line += "".join(",{}".format(count) for count in cha[i])
+            file.write(line + "\n")
+        file.close()
+
+
+def count_file(filename: str, counter_class: type = ChaCounter) -> ReactionCounter:
+    """
+        Counts sent messages and given/received chas (or all reactions
+        when counter_class is ReactionCounter) of each participant
+        in a single *.json file.
+    """
+    counter = counter_class()
+    counter.count(io.read_json(filename))
+    return counter
+
+
+def run(args: argparse.Namespace):
+    """
+        Counts chas (or all reactions) of the chat folder in args.path
+        and writes them to a file in the current directory.
+    """
+    file_path = args.path
 
     # Check if path exists
     if not path.exists(file_path):
         sys.exit('Provided relative path does not exist.')
 
-    pattern = path.join(
-        sys.argv[1], '*.json')
-
-    group = []
-
-    for file_name in glob(pattern):
-        # Iterate through each *.json file
-        with open(file_name) as f:
-            data = json.load(f)
-            # Check if there are any new participants in the group
-            for person in data["participants"]:
-                if not inGroup(group, person["name"]):
-                    # New participant detected
-                    group.append(Person(person["name"]))
-
-            # Add new participants to Person.gaveCha/Person.receivedCha for each Person in group.
-            for person in group:
-                for per in data["participants"]:
-                    if per["name"] not in person.gaveCha:
-                        person.gaveCha[per["name"]] = 0
-                        person.receivedCha[per["name"]] = 0
-
-            # Iterate through each message in *.json file
-            for message in data["messages"]:
-                # Increment the sent messages counter
-                senderIndex = findIndex(group, message["sender_name"])
-
-                if senderIndex == None:
-                    continue
-
-                group[senderIndex].numMessages += 1
-
-                # Search for cha reactions
-                if "reactions" in message:
-                    for reaction in message["reactions"]:
-                        # Unicode for cha reaction
-                        if reaction["reaction"] == u"\u00f0\u009f\u0098\u0086":
-                            giverName = reaction["actor"]
-                            giverIndex = findIndex(group, reaction["actor"])
-
-                            if giverIndex == None:
-                                continue
-
-                            # Message sender receives a Cha react from giverName
-                            group[senderIndex].numReceivedCha += 1
-                            group[senderIndex].receivedCha[giverName] += 1
-
-                            # Actor gives a Cha react to a sender
-                            group[giverIndex].numGivenCha += 1
-                            group[giverIndex].gaveCha[message["sender_name"]] += 1
+    counter_class = ReactionCounter if args.all_reactions else ChaCounter
+    counter = counter_class()
+
+    if args.workers == 1 and args.prefetch:
+        # Read next files ahead while counting the current one
+        for data in io.iter_group_files(file_path, args.prefetch):
+            counter.count(data)
+    else:
+        # Count each *.json file separately (in parallel if requested) and merge in file order
+        for file_counter in io.map_group_files(partial(count_file, counter_class=counter_class),
+                                               file_path, args.workers or None):
+            counter.merge(file_counter)
 
     # Find group name
     group_name = file_path.split("\\")[-1]
 
-    file = codecs.open(
-        "stats_{}.csv".format(group_name), "w", "iso-8859-1")
+    if args.all_reactions:
+        output_file = "reactions_{}.{}".format(
+            group_name, "parquet" if args.parquet else "csv")
+        if args.parquet:
+            counter.write_parquet(output_file)
+        else:
+            counter.write_csv(output_file)
+        print("Stats successfully calculated and saved to:\n\t{}".format(output_file))
+        return
 
-    # Constructing and writing header
-    header_line = "Participant name,Number of sent messages,Number of received chas,Number of sent chas,|Received chas from"
-    for item in sorted(group[0].receivedCha.items()):
-        header_line += ",{}".format(item[0])
-    header_line += ",|Sent chas to"
-    for item in sorted(group[0].gaveCha.items()):
-        header_line += ",{}".format(item[0])
-    header_line += "\n"
-    file.write(header_line)
+    counter.write_csv("stats_{}.csv".format(group_name))
 
-    # Sort participant list by Person.name
-    group.sort(key=lambda person: person.name)
+    print("Stats successfully calculated and saved to:\n\tstats_{}.csv".format(group_name))
 
-    # Writing data
-    for person in group:
-        file.write(person.return_csv())
-    file.close()
 
-    print("Stats successfully calculated and saved to:\n\tstats_{}.csv".format(group_name))
+def main():
+    parser = argparse.ArgumentParser(
+        description="Counts messages and Cha Cha reactions of a Messenger group chat.",
+        epilog="Command example:\n\tpython3 cha_counter.py <relative path to the specific chat folder>",
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    run(parser.parse_args())
 
 
 if __name__ == "__main__":
@@ -1,8 +1,26 @@
-import pandas as pd
+import hashlib
 import json
 import os
+import re
+import sys
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from glob import glob
 from datetime import datetime, date
+from functools import lru_cache, partial
+from typing import Iterable, TYPE_CHECKING
+import instrument
+
+# pandas is imported only by the functions that need it,
+# so reading and counting messages does not pay for its import.
+if TYPE_CHECKING:
+    import pandas as pd
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
 
 def read_json(filename: str) -> dict:
@@ -14,77 +32,541 @@ def read_json(filename: str) -> dict:
         print(f'{filename} is not a valid file. Exiting...')
         sys.exit(1)
 
+    return parse_json(read_bytes(filename))
+
+
+def load_json(filename: str):
+    """
+        Loads a json file written by dump_json (manifests, saved state,
+        baselines). Unlike read_json, it is not recorded in the
+        read_file/parse_json stages, which only count the export itself.
+    """
     with open(filename, "r") as infile:
-        data = json.load(infile)
+        return json.load(infile)
+
+
+def group_files(folder_path: str) -> list:
+    """
+        Takes in folder_path where the Messenger group
+        chats are stored, and returns the sorted list of
+        message_N.json files in it.
+    """
+    pattern = os.path.join(folder_path, '*.json')
+
+    return sorted(glob(pattern))
+
+
+def read_bytes(filename: str) -> bytes:
+    """
+        Returns raw contents of filename.
+    """
+    with instrument.stage("read_file") as stage, open(filename, "rb") as infile:
+        data = infile.read()
+        stage.rows_out = len(data)
+        return data
+
+
+def parse_json(data: bytes) -> dict:
+    """
+        Parses raw contents of a *.json file.
+    """
+    with instrument.stage("parse_json") as stage:
+        data = json.loads(data)
+        if isinstance(data, dict) and "messages" in data:
+            stage.rows_out = len(data["messages"])
         return data
 
 
-def load_group_messages(folder_path: str) -> list:
+def prefetch_files(file_names: list, depth: int = 2, threads: int = None):
+    """
+        Yields (file_name, raw contents) of file_names in order while
+        I/O threads read up to depth files ahead, so reading the next
+        files overlaps with processing the current one. At most depth
+        files are held in memory: reading stops until the consumer
+        takes the next file. threads defaults to depth.
+    """
+    file_names = iter(file_names)
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=threads or depth) as executor:
+        def read_next():
+            file_name = next(file_names, None)
+            if file_name is not None:
+                pending.append((file_name, executor.submit(read_bytes, file_name)))
+
+        for _ in range(max(depth, 1)):
+            read_next()
+
+        try:
+            while pending:
+                file_name, future = pending.popleft()
+                data = future.result()
+                # Start the next read before handing this file over
+                read_next()
+                yield file_name, data
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+
+def iter_group_files(folder_path: str, prefetch: int = 0):
+    """
+        Takes in folder_path where the Messenger group
+        chats are stored, and yields the contents of each
+        message_N.json file, one file at a time.
+        With prefetch > 0 up to prefetch files are read ahead
+        on I/O threads (see prefetch_files).
+    """
+    if prefetch:
+        for _, data in prefetch_files(group_files(folder_path), prefetch):
+            yield parse_json(data)
+        return
+
+    for file_name in group_files(folder_path):
+        yield read_json(file_name)
+
+
+def iter_file_messages(filename: str):
+    """
+        Takes in filename of a message_N.json file and yields its
+        messages one by one with an incremental JSON parser, so
+        the whole file is never materialized at once.
+    """
+    if ijson is None:
+        raise ImportError(
+            "Incremental parsing requires the ijson package: pip install ijson")
+
+    with open(filename, "rb") as infile:
+        yield from ijson.items(infile, "messages.item", use_float=True)
+
+
+def fix_text_encoding(text: str) -> str:
+    """
+        Messenger exports utf-8 text as iso-8859-1 escaped characters.
+        Changes encoding of text from iso-8859-1 to utf-8.
+        Text that is not escaped this way is returned unchanged.
+    """
+    try:
+        return bytes(text, 'iso-8859-1').decode('utf-8')
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return text
+
+
+@lru_cache(maxsize=None)
+def fix_encoding(text: str) -> str:
+    """
+        Same as fix_text_encoding, but each distinct string is decoded
+        only once and the result is interned. Meant for strings with
+        few distinct values, such as participant names and reactions.
+    """
+    return sys.intern(fix_text_encoding(text))
+
+
+# Short messages ("ok", "haha") repeat a lot, so a bounded cache pays off.
+fix_content_encoding = lru_cache(maxsize=4096)(fix_text_encoding)
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list:
+    """
+        Splits prepared (utf-8) text into lowercase words.
+    """
+    return WORD_PATTERN.findall(text.lower())
+
+
+def to_local_datetime(timestamps_ms, timezone: str = None) -> "pd.Series":
+    """
+        Converts unix timestamps in milliseconds (pd.Series or array)
+        to naive datetimes in timezone (e.g. "Europe/Vilnius").
+        System local timezone is used if timezone is not provided.
+    """
+    import pandas as pd
+    from dateutil.tz import tzlocal
+
+    dates = pd.to_datetime(pd.Series(timestamps_ms), unit="ms", utc=True)
+    return dates.dt.tz_convert(timezone or tzlocal()).dt.tz_localize(None)
+
+
+def truncate_dates(dates: "pd.Series", period: str) -> "pd.Series":
+    """
+        Truncates datetimes to the start of their period.
+        period is in ["day", "month", "year"].
+    """
+    unit = {"day": "datetime64[D]", "month": "datetime64[M]", "year": "datetime64[Y]"}
+    if period not in unit:
+        raise ValueError(
+            f'Bad period parameter provided: {period}. '
+            f'Please provide one of the valid parameters: [day|month|year]')
+
+    import pandas as pd
+
+    truncated = dates.to_numpy().astype(unit[period]).astype(dates.dtype)
+    return pd.Series(truncated, index=dates.index, name=dates.name)
+
+
+def message_fingerprint(message: dict) -> int:
+    """
+        Returns a 64-bit fingerprint of the sender, timestamp and
+        content of message. Equal messages from overlapping exports
+        have equal fingerprints.
+    """
+    key = "{}\x00{}\x00{}".format(
+        message["sender_name"], message["timestamp_ms"], message.get("content", ""))
+    return int.from_bytes(
+        hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+# Values of fields that are missing from some messages.
+FIELD_DEFAULTS = {
+    "content": None,
+    "type": "Generic",
+    "is_unsent": False,
+    "call_duration": 0
+}
+
+# Fields needed to compute message_fingerprint.
+FINGERPRINT_FIELDS = ("sender_name", "timestamp_ms", "content")
+
+
+def prepare_message(message: dict, fields: Iterable[str] = None) -> dict:
+    """
+        Fixes the encoding of the sender name, content and reactions.
+        If fields is provided, only those fields are fixed.
+        Timestamps are kept as timestamp_ms; use to_local_datetime
+        to convert them in bulk.
+    """
+    # Change encoding from iso-8859-1 to utf-8
+    if fields is None or "sender_name" in fields:
+        message["sender_name"] = fix_encoding(message["sender_name"])
+    if "content" in message and (fields is None or "content" in fields):
+        message["content"] = fix_content_encoding(message["content"])
+    if fields is None or "reactions" in fields:
+        for reaction in message.get("reactions", ()):
+            reaction["actor"] = fix_encoding(reaction["actor"])
+            reaction["reaction"] = fix_encoding(reaction["reaction"])
+
+    return message
+
+
+def project_message(message: dict, fields: Iterable[str]) -> dict:
+    """
+        Returns a new message containing only fields. Missing fields
+        are set to their FIELD_DEFAULTS value (None if there is none).
+    """
+    return {field: message.get(field, FIELD_DEFAULTS.get(field)) for field in fields}
+
+
+class Deduplicator():
+    """
+        Filters out messages whose fingerprint (see message_fingerprint)
+        was already seen. Only the 64-bit fingerprints are kept in memory.
+        The number of dropped messages is counted in `dropped`.
+    """
+
+    def __init__(self):
+        self.seen = set()
+        self.dropped = 0
+
+    def is_duplicate(self, message: dict) -> bool:
+        fingerprint = message_fingerprint(message)
+        if fingerprint in self.seen:
+            self.dropped += 1
+            return True
+        self.seen.add(fingerprint)
+        return False
+
+    def __call__(self, messages: Iterable[dict]):
+        for message in messages:
+            if not self.is_duplicate(message):
+                yield message
+
+
+def iter_group_messages(folder_path: str, incremental: bool = False,
+                        deduplicator: Deduplicator = None,
+                        fields: Iterable[str] = None, prefetch: int = 0):
+    """
+        Takes in folder_path where the Messenger group
+        chats are stored, and yields messages from the group
+        one by one. Only a single file is held in memory at a time;
+        with incremental=True not even a single file is.
+        If deduplicator is provided, duplicate messages are skipped.
+        If fields is provided (e.g. ["sender_name", "timestamp_ms", "is_unsent"]),
+        messages only contain those fields.
+        With prefetch > 0 (and incremental=False) up to prefetch files
+        are read ahead on I/O threads while earlier ones are processed.
+    """
+    prepare_fields = None
+    if fields is not None:
+        fields = tuple(fields)
+        prepare_fields = set(fields)
+        if deduplicator is not None:
+            prepare_fields.update(FINGERPRINT_FIELDS)
+
+    if incremental:
+        files = (iter_file_messages(file_name) for file_name in group_files(folder_path))
+    else:
+        files = (data["messages"] for data in iter_group_files(folder_path, prefetch))
+
+    for messages in files:
+        if incremental:
+            # Streamed messages are decoded one by one, so decoding is not timed apart
+            prepared = (prepare_message(message, prepare_fields) for message in messages)
+        else:
+            with instrument.stage("decode", len(messages)):
+                prepared = [prepare_message(message, prepare_fields) for message in messages]
+
+        for message in prepared:
+            if deduplicator is not None and deduplicator.is_duplicate(message):
+                continue
+            if fields is not None:
+                message = project_message(message, fields)
+            yield message
+
+
+def load_file_messages(filename: str) -> list:
+    """
+        Takes in filename of a message_N.json file and
+        returns its prepared messages.
+    """
+    messages = read_json(filename)["messages"]
+    with instrument.stage("decode", len(messages)):
+        return [prepare_message(message) for message in messages]
+
+
+def map_group_files(function, folder_path: str, workers: int = 1):
+    """
+        Applies function to each message_N.json file name in folder_path
+        and yields the results in file order. With workers other than 1
+        files are processed in a pool of worker processes
+        (workers=None uses all cores). Stages recorded in workers
+        are added to the active profiler.
+    """
+    file_names = group_files(folder_path)
+
+    if workers == 1:
+        yield from map(function, file_names)
+        return
+
+    profiler = instrument.active
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        if profiler is None:
+            yield from executor.map(function, file_names)
+            return
+
+        # Workers record their stages and send them back with the results
+        for result, records in executor.map(
+                partial(instrument.call_recorded, function, profiler.trace_memory), file_names):
+            profiler.add_records(records)
+            yield result
+
+
+def load_group_messages(folder_path: str, workers: int = 1,
+                        deduplicator: Deduplicator = None, prefetch: int = 0) -> list:
     """
         Takes in folder_path where the Messenger group 
         chats are stored, and returns all messages from the group.
+        Files are parsed in parallel when workers is not 1.
+        If deduplicator is provided, duplicate messages are skipped.
+        With prefetch > 0 files are read ahead when workers is 1.
     """
-    pattern = os.path.join(folder_path, '*.json')
+    with instrument.stage("load_group_messages") as stage:
+        if workers == 1:
+            messages = list(iter_group_messages(folder_path, deduplicator=deduplicator,
+                                                prefetch=prefetch))
+        else:
+            messages = []
+            for file_messages in map_group_files(load_file_messages, folder_path, workers):
+                if deduplicator is not None:
+                    file_messages = deduplicator(file_messages)
+                messages.extend(file_messages)
+        stage.rows_out = len(messages)
 
-    messages = []
+    return messages
 
-    for file_name in glob(pattern):
 
-        message_file = read_json(file_name)
-        for message in message_file["messages"]:
-            # Convert timestamp to local datetime.
-            message["date_local"] = datetime.fromtimestamp(
-                message["timestamp_ms"]/1000)
-            # Change encoding from iso-8859-1 to utf-8
-            message["sender_name"] = bytes(
-                message["sender_name"], 'iso-8859-1').decode('utf-8')
+class MessageTable():
+    """
+        Compact struct-of-arrays storage of messages for counting.
+        Sender names, actors, reactions and message types are interned
+        into per table lists and stored as small integer ids next to
+        int64 timestamps, so a message takes a few dozen bytes instead
+        of a dict per message and per reaction. Content is not kept.
+    """
 
-            messages.append(message)
+    def __init__(self):
+        # Interned strings, ids are positions in these lists
+        self.names = []
+        self.name_index = {}
+        self.types = []
+        self.type_index = {}
+        self.reaction_names = []
+        self.reaction_index = {}
 
-    return messages
+        # One item per message
+        self.sender = array("I")
+        self.timestamp_ms = array("q")
+        self.type = array("B")
+        self.is_unsent = array("b")
+        # Number of photos/videos, -1 if the message has no such field
+        self.photos = array("i")
+        self.videos = array("i")
+        self.call_duration = array("q")
+
+        # One item per reaction, reaction_message is the row of the message reacted to
+        self.reaction_message = array("I")
+        self.reaction_actor = array("I")
+        self.reaction = array("I")
+
+    def __len__(self) -> int:
+        return len(self.sender)
+
+    @staticmethod
+    def intern(value: str, values: list, index: dict) -> int:
+        """
+            Returns the id of value in values, adding it if it is new.
+        """
+        value_id = index.get(value)
+        if value_id is None:
+            value_id = index[value] = len(values)
+            values.append(value)
+        return value_id
+
+    def append(self, message: dict):
+        """
+            Adds a single message (raw or prepared) to the table.
+        """
+        row = len(self.sender)
+        self.sender.append(self.intern(message["sender_name"], self.names, self.name_index))
+        self.timestamp_ms.append(message["timestamp_ms"])
+        self.type.append(self.intern(message.get("type", FIELD_DEFAULTS["type"]),
+                                     self.types, self.type_index))
+        self.is_unsent.append(message.get("is_unsent", False))
+        self.photos.append(len(message["photos"]) if "photos" in message else -1)
+        self.videos.append(len(message["videos"]) if "videos" in message else -1)
+        self.call_duration.append(message.get("call_duration", 0))
+
+        for reaction in message.get("reactions", ()):
+            self.reaction_message.append(row)
+            self.reaction_actor.append(
+                self.intern(reaction["actor"], self.names, self.name_index))
+            self.reaction.append(
+                self.intern(reaction["reaction"], self.reaction_names, self.reaction_index))
+
+    def extend(self, other: "MessageTable"):
+        """
+            Appends all messages of other table, remapping its ids.
+        """
+        names = [self.intern(name, self.names, self.name_index) for name in other.names]
+        types = [self.intern(name, self.types, self.type_index) for name in other.types]
+        reactions = [self.intern(name, self.reaction_names, self.reaction_index)
+                     for name in other.reaction_names]
+        offset = len(self.sender)
 
+        self.sender.extend(names[i] for i in other.sender)
+        self.timestamp_ms.extend(other.timestamp_ms)
+        self.type.extend(types[i] for i in other.type)
+        self.is_unsent.extend(other.is_unsent)
+        self.photos.extend(other.photos)
+        self.videos.extend(other.videos)
+        self.call_duration.extend(other.call_duration)
 
-def load_group_reactions_sent(folder_path: str) -> list:
+        self.reaction_message.extend(row + offset for row in other.reaction_message)
+        self.reaction_actor.extend(names[i] for i in other.reaction_actor)
+        self.reaction.extend(reactions[i] for i in other.reaction)
+
+    @classmethod
+    def from_messages(cls, messages: Iterable[dict]) -> "MessageTable":
+        """
+            Builds a table from messages, e.g. iter_group_messages.
+        """
+        table = cls()
+        for message in messages:
+            table.append(message)
+        return table
+
+
+def load_file_table(filename: str) -> MessageTable:
+    """
+        Takes in filename of a message_N.json file and
+        returns its prepared messages as a MessageTable.
+    """
+    return MessageTable.from_messages(
+        prepare_message(message) for message in read_json(filename)["messages"])
+
+
+def load_group_table(folder_path: str, workers: int = 1,
+                     deduplicator: Deduplicator = None) -> MessageTable:
+    """
+        Same as load_group_messages, but returns the messages as
+        a MessageTable. Files are parsed in parallel when workers is not 1,
+        unless deduplicator is provided.
+    """
+    with instrument.stage("load_group_table") as stage:
+        if workers == 1 or deduplicator is not None:
+            table = MessageTable.from_messages(
+                iter_group_messages(folder_path, deduplicator=deduplicator))
+        else:
+            table = MessageTable()
+            for file_table in map_group_files(load_file_table, folder_path, workers):
+                table.extend(file_table)
+        stage.rows_out = len(table)
+
+    return table
+
+
+def iter_group_reactions_sent(folder_path: str, incremental: bool = False,
+                              deduplicator: Deduplicator = None):
     """
         Takes in folder_path where the Messenger group 
-        chats are stored, and returns all reactions 
+        chats are stored, and yields all reactions 
         that were sent by each participant of the group. 
+        Reactions of duplicate messages are skipped if deduplicator is provided.
     """
-    messages = load_group_messages(folder_path)
-    ret_data = []
-    for message in messages:
+    for message in iter_group_messages(folder_path, incremental, deduplicator):
         if "reactions" in message:
             for reaction in message["reactions"]:
-                _reaction = {
-                    "participant": bytes(
-                        reaction["actor"], 'iso-8859-1').decode('utf-8'),
+                yield {
+                    "participant": reaction["actor"],
                     "reaction": reaction["reaction"],
-                    "date_local": message["date_local"]
+                    "timestamp_ms": message["timestamp_ms"]
                 }
-                ret_data.append(_reaction)
-
-    return ret_data
 
 
-def load_group_reactions_received(folder_path: str) -> list:
+def load_group_reactions_sent(folder_path: str, deduplicator: Deduplicator = None) -> list:
     """
         Takes in folder_path where the Messenger group 
         chats are stored, and returns all reactions 
+        that were sent by each participant of the group. 
+    """
+    return list(iter_group_reactions_sent(folder_path, deduplicator=deduplicator))
+
+
+def iter_group_reactions_received(folder_path: str, incremental: bool = False,
+                                  deduplicator: Deduplicator = None):
+    """
+        Takes in folder_path where the Messenger group 
+        chats are stored, and yields all reactions 
         that were received by each participant of the group. 
+        Reactions of duplicate messages are skipped if deduplicator is provided.
     """
-    messages = load_group_messages(folder_path)
-    ret_data = []
-    for message in messages:
+    for message in iter_group_messages(folder_path, incremental, deduplicator):
         if "reactions" in message:
             for reaction in message["reactions"]:
-                _reaction = {
+                yield {
                     "participant": message["sender_name"],
                     "reaction": reaction["reaction"],
-                    "date_local": message["date_local"]
+                    "timestamp_ms": message["timestamp_ms"]
                 }
-                ret_data.append(_reaction)
 
-    return ret_data
+
+def load_group_reactions_received(folder_path: str, deduplicator: Deduplicator = None) -> list:
+    """
+        Takes in folder_path where the Messenger group 
+        chats are stored, and returns all reactions 
+        that were received by each participant of the group. 
+    """
+    return list(iter_group_reactions_received(folder_path, deduplicator=deduplicator))
 
 
 def json_serial(obj):
@@ -104,7 +586,7 @@ def dump_json(output_data, output_file: str):
         json.dump(output_data, outfile, default=json_serial)
 
 
-def output_df_to_csv(df: pd.DataFrame, output_file: str):
+def output_df_to_csv(df: "pd.DataFrame", output_file: str):
     """
         Takes in pd.DataFrame and outputs it to specified output_file.
     """
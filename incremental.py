@@ -0,0 +1,118 @@
+import argparse
+import os
+import sys
+from typing import Iterable
+import aggregate
+import data_io as io
+
+
+def incremental_metrics() -> list:
+    """
+        Returns a new instance of metrics whose state is persisted
+        between incremental updates.
+    """
+    return [aggregate.MessageCounts(), aggregate.ChaMatrix(),
+            aggregate.PeriodCounts("day")]
+
+
+def new_messages(messages: Iterable[dict], watermark: dict):
+    """
+        Yields messages that are newer than watermark, i.e. have later
+        timestamp_ms, or the same timestamp_ms but an unseen fingerprint.
+    """
+    last_timestamp = watermark["timestamp_ms"]
+    fingerprints = set(watermark["fingerprints"])
+
+    for message in messages:
+        timestamp = message["timestamp_ms"]
+        if timestamp > last_timestamp:
+            yield message
+        elif timestamp == last_timestamp:
+            fingerprint = io.message_fingerprint(message)
+            if fingerprint not in fingerprints:
+                fingerprints.add(fingerprint)
+                yield message
+
+
+class Watermark():
+    """
+        Tracks the latest timestamp_ms of seen messages together with
+        fingerprints of all messages having that timestamp.
+    """
+
+    def __init__(self, watermark: dict):
+        self.timestamp_ms = watermark["timestamp_ms"]
+        self.fingerprints = set(watermark["fingerprints"])
+
+    def add(self, message: dict):
+        timestamp = message["timestamp_ms"]
+        if timestamp > self.timestamp_ms:
+            self.timestamp_ms = timestamp
+            self.fingerprints = {io.message_fingerprint(message)}
+        elif timestamp == self.timestamp_ms:
+            self.fingerprints.add(io.message_fingerprint(message))
+
+    def state(self) -> dict:
+        return {"timestamp_ms": self.timestamp_ms,
+                "fingerprints": sorted(self.fingerprints)}
+
+
+def update(folder_path: str, state_path: str, metrics: list = None) -> dict:
+    """
+        Folds messages of folder_path that are newer than the watermark
+        stored in state_path into the persisted metrics, saves the new
+        state and returns the results of metrics.
+        If state_path does not exist, all messages are processed.
+    """
+    if metrics is None:
+        metrics = incremental_metrics()
+
+    state = {"watermark": {"timestamp_ms": -1, "fingerprints": []}, "metrics": {}}
+    if os.path.isfile(state_path):
+        state = io.load_json(state_path)
+        for metric in metrics:
+            if metric.name in state["metrics"]:
+                metric.load_state(state["metrics"][metric.name])
+
+    watermark = Watermark(state["watermark"])
+    num_new = 0
+
+    for message in new_messages(io.iter_group_messages(folder_path), state["watermark"]):
+        watermark.add(message)
+        num_new += 1
+        for metric in metrics:
+            metric.add(message)
+
+    print(f"Folded in {num_new} new messages.")
+
+    state = {
+        "watermark": watermark.state(),
+        "metrics": {metric.name: metric.state() for metric in metrics}
+    }
+    io.dump_json(state, state_path)
+
+    return {metric.name: metric.result() for metric in metrics}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Updates persisted stats of a Messenger group chat with new messages only.")
+    parser.add_argument("path", help="relative path to the specific chat folder")
+    parser.add_argument("-s", "--state", help="state file (default: state_<groupname>.json)")
+    parser.add_argument("-o", "--output", help="stats file (default: stats_<groupname>.json)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        sys.exit('Provided relative path does not exist.')
+
+    group_name = os.path.basename(os.path.normpath(args.path))
+    state_path = args.state or f"state_{group_name}.json"
+    output_path = args.output or f"stats_{group_name}.json"
+
+    io.dump_json(update(args.path, state_path), output_path)
+
+    print(f"Stats successfully updated and saved to:\n\t{output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+import cProfile
+import io as _io
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+
+
+class Stage():
+    """
+        A single timed run of a named stage. Code inside the stage may set
+        rows_in and rows_out (e.g. messages read and rows produced).
+    """
+
+    def __init__(self, profiler: "Profiler", name: str, rows_in: int = None):
+        self.profiler = profiler
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.seconds = 0.0
+        # Traced memory at start and highest traced memory during the stage
+        self.memory_start = 0
+        self.memory_peak = 0
+
+    def __enter__(self) -> "Stage":
+        self.profiler.start_stage(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self.start
+        self.profiler.end_stage(self)
+        return False
+
+    def record(self) -> dict:
+        return {
+            "stage": self.name,
+            "seconds": self.seconds,
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            # None if memory was not traced
+            "peak_mb": ((self.memory_peak - self.memory_start) / 2**20
+                        if self.memory_peak else None)
+        }
+
+
+class NullStage():
+    """
+        Stage used while no profiler is active. Does nothing.
+    """
+    rows_in = None
+    rows_out = None
+
+    def __enter__(self) -> "NullStage":
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+NULL_STAGE = NullStage()
+
+# Profiler whose stages are recorded, see Profiler.__enter__
+active = None
+
+
+def stage(name: str, rows_in: int = None):
+    """
+        Returns a context manager timing stage name in the active
+        profiler. It costs almost nothing when no profiler is active:
+
+            with instrument.stage("parse_json") as s:
+                data = ...
+                s.rows_out = len(data["messages"])
+    """
+    if active is None:
+        return NULL_STAGE
+    return Stage(active, name, rows_in)
+
+
+def call_recorded(function, trace_memory: bool, *args) -> tuple:
+    """
+        Calls function(*args) under a new Profiler and returns (result,
+        records of its stages). Used in worker processes, where the
+        profiler of the parent process is not active.
+    """
+    records = []
+    with Profiler(trace_memory, hooks=[records.append]):
+        result = function(*args)
+    return result, records
+
+
+class Profiler():
+    """
+        Collects per-stage wall time, rows in/out and peak memory of
+        the stages run inside a `with Profiler():` block.
+        Peak memory is traced (tracemalloc) only if trace_memory is True,
+        since tracing slows Python code down a lot.
+        If profile is True, the whole block also runs under cProfile.
+        Each hook is called with the record (dict) of every finished stage.
+        Stages may run on several threads (e.g. prefetching reads), each
+        thread nests its stages on its own stack. tracemalloc peaks are
+        process-wide, so peak memory is only attributed to stages of the
+        thread that entered the profiler.
+    """
+
+    def __init__(self, trace_memory: bool = False, profile: bool = False,
+                 hooks: list = None):
+        self.trace_memory = trace_memory
+        self.profile = cProfile.Profile() if profile else None
+        self.hooks = list(hooks or [])
+        # Aggregated records of stages by name, in order of first run
+        self.stages = {}
+        # Per-thread stacks of running stages, see stack
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.seconds = 0.0
+
+    @property
+    def stack(self) -> list:
+        """
+            Running stages of the current thread, innermost last.
+        """
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def traces_memory(self) -> bool:
+        return tracemalloc.is_tracing() and threading.get_ident() == self.thread
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def __enter__(self) -> "Profiler":
+        global active
+        self.previous, active = active, self
+        self.thread = threading.get_ident()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        else:
+            self.started_tracing = False
+        if self.profile is not None:
+            self.profile.enable()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        global active
+        self.seconds += time.perf_counter() - self.start
+        if self.profile is not None:
+            self.profile.disable()
+        if self.started_tracing:
+            tracemalloc.stop()
+        active = self.previous
+        return False
+
+    def start_stage(self, stage: Stage):
+        stack = self.stack
+        if self.traces_memory():
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                parent = stack[-1]
+                parent.memory_peak = max(parent.memory_peak, peak)
+            tracemalloc.reset_peak()
+            stage.memory_start = stage.memory_peak = current
+        stack.append(stage)
+
+    def end_stage(self, stage: Stage):
+        stack = self.stack
+        stack.pop()
+        if self.traces_memory():
+            stage.memory_peak = max(stage.memory_peak, tracemalloc.get_traced_memory()[1])
+            if stack:
+                parent = stack[-1]
+                parent.memory_peak = max(parent.memory_peak, stage.memory_peak)
+
+        record = stage.record()
+        with self.lock:
+            self.add_record(record)
+            for hook in self.hooks:
+                hook(record)
+
+    def add_records(self, records: list):
+        """
+            Adds records of stages run elsewhere (see call_recorded).
+        """
+        with self.lock:
+            for record in records:
+                self.add_record(record)
+                for hook in self.hooks:
+                    hook(record)
+
+    def add_record(self, record: dict):
+        total = self.stages.get(record["stage"])
+        if total is None:
+            self.stages[record["stage"]] = dict(record, calls=1)
+            return
+
+        total["calls"] += 1
+        total["seconds"] += record["seconds"]
+        for key in ["rows_in", "rows_out"]:
+            if record[key] is not None:
+                total[key] = (total[key] or 0) + record[key]
+        if record["peak_mb"] is not None:
+            total["peak_mb"] = max(total["peak_mb"] or 0, record["peak_mb"])
+
+    def profile_stats(self, limit: int = 30) -> str:
+        """
+            Returns the cProfile listing of the limit functions with
+            the highest cumulative time.
+        """
+        stream = _io.StringIO()
+        pstats.Stats(self.profile, stream=stream).sort_stats("cumulative").print_stats(limit)
+        return stream.getvalue()
+
+    def report(self) -> dict:
+        """
+            Returns the stages (wall time summed over calls, rows summed,
+            largest peak memory) and total time as a dict.
+        """
+        report = {
+            "seconds": self.seconds,
+            "trace_memory": self.trace_memory,
+            "stages": list(self.stages.values())
+        }
+        if self.profile is not None:
+            report["profile"] = self.profile_stats()
+        return report
+
+    def dump_report(self, output_file: str):
+        """
+            Writes report() to a json file.
+        """
+        with open(output_file, "w") as outfile:
+            json.dump(self.report(), outfile, indent=2)
+
+    def print_report(self):
+        print("stage,calls,seconds,rows_in,rows_out,peak_mb")
+        for record in self.stages.values():
+            rows_in, rows_out, peak_mb = [
+                "" if record[key] is None else record[key]
+                for key in ["rows_in", "rows_out", "peak_mb"]]
+            if peak_mb != "":
+                peak_mb = f"{peak_mb:.2f}"
+            print(f"{record['stage']},{record['calls']},{record['seconds']:.4f},"
+                  f"{rows_in},{rows_out},{peak_mb}")
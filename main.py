@@ -1,25 +1,259 @@
-import data_io as io
-import plot
-import stats
+import argparse
+import importlib
+import os
+import sys
+import cha_arguments
 
-# def main():
-#     start = pd.Timestamp(2019, 8, 1)
-#     end = pd.Timestamp(2019, 9, 1)
+# Modules each subcommand needs. They are imported only when the
+# subcommand runs, so e.g. `messages` never imports pandas or matplotlib.
+SUBCOMMAND_MODULES = {
+    "messages": ["data_io", "stats"],
+    "reactions": ["data_io"],
+    "sketch": ["data_io", "stats"],
+    "cha": ["cha_counter"],
+    "plot": ["plot"],
+    "search": ["data_io", "text_index"],
+    "analytics": ["data_io", "rollup", "analytics"],
+    "sessions": ["data_io", "sessions"],
+}
 
-#     # plot.number_of_messages_per_day('..\\baudykla\\', start, end)
 
-#     plot.number_of_messages_per_day('..\\saulyte\\')
+def import_subcommand(name: str) -> list:
+    """
+        Imports and returns the modules needed by subcommand name.
+    """
+    return [importlib.import_module(module) for module in SUBCOMMAND_MODULES[name]]
+
+
+def group_name(folder_path: str) -> str:
+    return os.path.basename(os.path.normpath(folder_path))
+
+
+def run_messages(args: argparse.Namespace):
+    """
+        Writes the number of messages, photos, videos and calls
+        of each participant to a json file.
+    """
+    io, stats = import_subcommand("messages")
+    output_file = args.output or f"num_messages_{group_name(args.path)}.json"
+
+    if os.path.isfile(os.path.join(args.path, "store.json")):
+        # Binary store written by store.py
+        import store
+        ret_data = stats.number_of_messages_table(store.open_store(args.path))
+    else:
+        ret_data = stats.number_of_messages(
+            io.iter_group_messages(args.path, prefetch=args.prefetch))
+
+    io.dump_json(ret_data, output_file)
+    print(f"Stats successfully calculated and saved to:\n\t{output_file}")
+
+
+def run_reactions(args: argparse.Namespace):
+    """
+        Writes all reactions sent or received by each participant to a json file.
+    """
+    io, = import_subcommand("reactions")
+    output_file = args.output or f"reactions_{args.switch}_{group_name(args.path)}.json"
+
+    if args.switch == "sent":
+        reactions = io.load_group_reactions_sent(args.path, io.Deduplicator())
+    else:
+        reactions = io.load_group_reactions_received(args.path, io.Deduplicator())
+
+    io.dump_json(reactions, output_file)
+    print(f"Reactions successfully saved to:\n\t{output_file}")
+
+
+def run_sketch(args: argparse.Namespace):
+    """
+        Writes approximate content stats (distinct words, top words, most
+        reacted messages, message length quantiles) to a json file.
+    """
+    io, stats = import_subcommand("sketch")
+    output_file = args.output or f"sketches_{group_name(args.path)}.json"
+
+    io.dump_json(stats.approximate_stats(
+        io.iter_group_messages(args.path, prefetch=args.prefetch)), output_file)
+    print(f"Stats successfully calculated and saved to:\n\t{output_file}")
+
+
+def run_cha(args: argparse.Namespace):
+    """
+        Same as running cha_counter.py.
+    """
+    cha_counter, = import_subcommand("cha")
+    cha_counter.run(args)
+
+
+def run_plot(args: argparse.Namespace):
+    """
+        Plots messages or reactions of each participant per period.
+    """
+    plot, = import_subcommand("plot")
+    if args.output:
+        plot.set_headless()
+
+    if args.what == "messages":
+        plot.number_of_messages_per_period(
+            args.path, args.period, args.from_date, args.to_date, args.timezone, args.output)
+    else:
+        plot.number_of_reactions_per_period(
+            args.path, args.switch, args.period, args.from_date, args.to_date,
+            args.timezone, args.output)
+
+
+def run_search(args: argparse.Namespace):
+    """
+        Counts messages containing a word or phrase per participant and
+        writes the counts per period to a csv file.
+    """
+    io, text_index = import_subcommand("search")
+    output_file = args.output or f"search_{group_name(args.path)}.csv"
+    index = text_index.load_index(args.path)
+
+    for name, count in index.count_by_participant(args.query).items():
+        print(f"{name}: {count}")
+    io.output_df_to_csv(index.count_per_period(args.query, args.period, args.timezone),
+                        output_file)
+
+
+def run_analytics(args: argparse.Namespace):
+    """
+        Writes activity streaks, silences and chat-wide silence gaps to a
+        json file and rolling daily rates to a csv file.
+    """
+    io, rollup, analytics = import_subcommand("analytics")
+    name = group_name(args.path)
+    index = rollup.load_index(args.path, args.timezone)
+
+    io.dump_json({
+        "streaks": analytics.records(analytics.longest_streaks(index, args.metric)),
+        "silences": analytics.records(analytics.longest_silences(index, args.metric)),
+        "gaps": analytics.records(analytics.silence_gaps(index, args.metric, args.min_gap))
+    }, f"analytics_{name}.json")
+    io.output_df_to_csv(analytics.rolling_rates(index, args.metric, args.windows),
+                        f"rates_{name}.csv")
+
+    print(f"Analytics successfully calculated and saved to:\n\tanalytics_{name}.json")
+
+
+def run_sessions(args: argparse.Namespace):
+    """
+        Writes reply latencies and sessions to csv files and the number
+        of sessions each participant started to a json file.
+    """
+    io, sessions = import_subcommand("sessions")
+    name = group_name(args.path)
+    timeline = sessions.load_timeline(args.path, args.idle)
+
+    io.output_df_to_csv(sessions.reply_latency(timeline), f"reply_latency_{name}.csv")
+    io.output_df_to_csv(timeline.sessions(args.timezone), f"sessions_{name}.csv")
+    io.dump_json(sessions.session_starters(timeline), f"session_starters_{name}.json")
+
+    print(f"Found {len(timeline.session_starts)} sessions in {len(timeline)} messages.")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Facebook Messenger chat stats.")
+    parser.add_argument("--report", metavar="FILE",
+                        help="write per-stage time and rows of the run to a json file")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="add peak memory of each stage to the report (slower)")
+    parser.add_argument("--cprofile", action="store_true",
+                        help="add a cProfile listing to the report")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    messages = subparsers.add_parser("messages", help="count messages of each participant")
+    messages.add_argument("path", help="relative path to the specific chat folder")
+    messages.add_argument("-o", "--output", help="output json file")
+    messages.add_argument("--prefetch", type=int, default=0,
+                          help="number of *.json files read ahead on I/O threads")
+    messages.set_defaults(run=run_messages)
+
+    reactions = subparsers.add_parser("reactions", help="dump reactions of each participant")
+    reactions.add_argument("path", help="relative path to the specific chat folder")
+    reactions.add_argument("switch", choices=["sent", "received"])
+    reactions.add_argument("-o", "--output", help="output json file")
+    reactions.set_defaults(run=run_reactions)
+
+    sketch = subparsers.add_parser(
+        "sketch", help="approximate word, reaction and length stats in bounded memory")
+    sketch.add_argument("path", help="relative path to the specific chat folder")
+    sketch.add_argument("-o", "--output", help="output json file")
+    sketch.add_argument("--prefetch", type=int, default=0,
+                        help="number of *.json files read ahead on I/O threads")
+    sketch.set_defaults(run=run_sketch)
+
+    # cha_arguments does not import numpy, unlike cha_counter
+    cha = subparsers.add_parser("cha", help="count Cha Cha reactions (same as cha_counter.py)")
+    cha_arguments.add_arguments(cha)
+    cha.set_defaults(run=run_cha)
+
+    plot = subparsers.add_parser("plot", help="plot messages or reactions per period")
+    plot.add_argument("path", help="relative path to the specific chat folder")
+    plot.add_argument("what", choices=["messages", "reactions"])
+    plot.add_argument("-s", "--switch", choices=["sent", "received"], default="received",
+                      help="plot sent or received reactions")
+    plot.add_argument("-p", "--period", default="day",
+                      choices=["day", "week", "month", "quarter", "year"])
+    plot.add_argument("--from", dest="from_date", help="first date, e.g. 2019-08-01")
+    plot.add_argument("--to", dest="to_date", help="last date, e.g. 2019-09-01")
+    plot.add_argument("--timezone", help="timezone of dates, e.g. Europe/Vilnius (default: local)")
+    plot.add_argument("-o", "--output",
+                      help="write chart to this file (png, svg, ...) without a display")
+    plot.set_defaults(run=run_plot)
+
+    analytics = subparsers.add_parser(
+        "analytics", help="activity streaks, silences and rolling rates")
+    analytics.add_argument("path", help="relative path to the specific chat folder")
+    analytics.add_argument("-m", "--metric", default="messages",
+                           help="messages, reactions_sent or reactions_received")
+    analytics.add_argument("--timezone",
+                           help="timezone of dates, e.g. Europe/Vilnius (default: local)")
+    analytics.add_argument("--min-gap", type=int, default=7,
+                           help="shortest chat-wide silence to report, in days")
+    analytics.add_argument("-w", "--windows", type=int, nargs="+", default=[7, 30],
+                           help="rolling rate windows in days")
+    analytics.set_defaults(run=run_analytics)
+
+    sessions = subparsers.add_parser("sessions", help="reply latencies and conversation sessions")
+    sessions.add_argument("path", help="relative path to the specific chat folder")
+    sessions.add_argument("-i", "--idle", type=float, default=30,
+                          help="minutes without messages that end a session")
+    sessions.add_argument("--timezone",
+                          help="timezone of dates, e.g. Europe/Vilnius (default: local)")
+    sessions.set_defaults(run=run_sessions)
+
+    search = subparsers.add_parser("search", help="count messages containing a word or phrase")
+    search.add_argument("path", help="relative path to the specific chat folder")
+    search.add_argument("query", help="word or phrase to look for")
+    search.add_argument("-p", "--period", default="month", choices=["day", "month", "year"])
+    search.add_argument("--timezone", help="timezone of dates, e.g. Europe/Vilnius (default: local)")
+    search.add_argument("-o", "--output", help="output csv file")
+    search.set_defaults(run=run_search)
+
+    return parser
 
 
 def main():
-    # messages = io.load_group_messages("..\\saulyte\\")
-    # num_messages = stats.number_of_messages(messages)
-    # io.dump_json(num_messages, "num_messages.json")
+    args = build_parser().parse_args()
+
+    if not os.path.exists(args.path):
+        sys.exit('Provided relative path does not exist.')
+
+    if not args.report:
+        args.run(args)
+        return
+
+    import instrument
 
-    # reactions = io.load_group_reactions_received("..\\baudykla\\")
-    # io.dump_json(reactions, "reactions_received.json")
+    with instrument.Profiler(args.trace_memory, args.cprofile) as profiler:
+        args.run(args)
 
-    plot.number_of_reactions_per_month("..\\baudykla\\", "received")
+    profiler.print_report()
+    profiler.dump_report(args.report)
+    print(f"Report saved to:\n\t{args.report}")
 
 
 if __name__ == "__main__":
@@ -1,44 +1,199 @@
-from datetime import date, datetime
+import os
+import time
 import pandas as pd
 import numpy as np
+import cache
 import data_io as io
+import instrument
+import rollup
+import store
 import matplotlib.pyplot as plt
-plt.close("all")
 
 
-def prepare_data_for_messages_per_period(folder_path: str) -> pd.DataFrame:
+def group_data_per_period(df: pd.DataFrame,
+                          key: str,
+                          from_date: pd.Timestamp,
+                          to_date: pd.Timestamp,
+                          period_days: int,
+                          period_months: int) -> pd.DataFrame:
     """
+        Counts rows of df per `key` and date, and ensures that there is
+        a record (zero-filled if needed) for each `key` and each period
+        from from_date to to_date.
+    """
+    with instrument.stage("group_per_period", len(df.index)) as stage:
+        # Group data by key and date.
+        df1 = pd.DataFrame({'count': df.groupby(
+            [key, "date_local"]).size()}).reset_index()
+
+        # Prepare dates of the range we will extract data from.
+        if not from_date:
+            min_date = df1.date_local.min()
+        else:
+            min_date = from_date
+        if not to_date:
+            max_date = df1.date_local.max()
+        else:
+            max_date = to_date
+
+        # Nothing to fill (e.g. a chat without reactions).
+        if pd.isna(min_date) or pd.isna(max_date):
+            return pd.DataFrame({key: pd.Series(dtype=object),
+                                 "date_local": pd.Series(dtype="datetime64[ns]"),
+                                 "count": pd.Series(dtype=np.int64)})
+
+        # Remove out of bound dates.
+        df1 = df1[((df1.date_local >= min_date) & (df1.date_local <= max_date))]
+
+        # Find distinct participants.
+        participants = df1[key].unique()
+
+        # Ensure data continuity that there is a record for each period from min_date to max_date.
+        # The full participants x periods grid is built at once and missing entries are zero-filled.
+        print("Ensuring data continuity for each participant...")
+        periods = pd.date_range(min_date, max_date, freq=pd.DateOffset(
+            months=period_months, days=period_days))
+        grid = pd.MultiIndex.from_product(
+            [participants, periods], names=[key, "date_local"])
+        df1 = df1.set_index([key, "date_local"])
+        df1 = df1.reindex(grid.union(df1.index), fill_value=0).reset_index()
+
+        df1 = df1.sort_values(by=["date_local", key], ignore_index=True)
+        stage.rows_out = len(df1.index)
+
+    return df1
+
+
+def pivot_period_counts(df: pd.DataFrame, key: str) -> pd.DataFrame:
+    """
+        Pivots grouped counts (key, date_local, count) once into a wide
+        period x participant table, missing entries are zero-filled.
+    """
+    with instrument.stage("pivot", len(df.index)) as stage:
+        wide = df.pivot_table(index="date_local", columns=key, values="count",
+                              aggfunc="sum", fill_value=0, observed=True).sort_index()
+        stage.rows_out = len(wide.index)
+
+    return wide
+
+
+class ChartRenderer():
+    """
+        Renders line charts of wide (period x participant) tables.
+        Charts written to files reuse a single figure, so many charts can
+        be rendered from one process. Render time of each chart is kept
+        in `timings`.
+    """
+
+    def __init__(self, figsize: tuple = (12, 6), dpi: int = 100):
+        self.figsize = figsize
+        self.dpi = dpi
+        self.figure = None
+        self.timings = []
+
+    def render(self, wide: pd.DataFrame, ylabel: str, output_file: str = None) -> float:
+        """
+            Plots each column of wide as a line. Writes the chart to
+            output_file (format from its extension, e.g. .png or .svg)
+            or shows it if output_file is not provided.
+            Returns render time in seconds.
+        """
+        start = time.perf_counter()
+
+        with instrument.stage("render", wide.size):
+            if output_file is None:
+                plt.close("all")
+                figure = plt.figure(figsize=self.figsize, dpi=self.dpi)
+            else:
+                if self.figure is None:
+                    self.figure = plt.figure(figsize=self.figsize, dpi=self.dpi)
+                figure = self.figure
+                figure.clf()
+
+            axes = figure.add_subplot()
+            axes.plot(wide.index, wide.to_numpy())
+            axes.set_ylabel(ylabel)
+            axes.grid(color='lightgrey', linestyle='--', linewidth=1)
+            axes.legend(list(wide.columns))
+
+            if output_file is None:
+                plt.show()
+            else:
+                figure.savefig(output_file)
+
+        elapsed = time.perf_counter() - start
+        self.timings.append((output_file, elapsed))
+        print(f"Rendered {output_file or 'chart'} in {elapsed:.3f}s")
+
+        return elapsed
+
+
+renderer = None
+
+
+def get_renderer() -> ChartRenderer:
+    """
+        Returns the ChartRenderer shared by all plot functions.
+    """
+    global renderer
+    if renderer is None:
+        renderer = ChartRenderer()
+    return renderer
+
+
+def set_headless():
+    """
+        Switches matplotlib to the non-interactive Agg backend, so charts
+        can be written to files on machines without a display.
+    """
+    plt.switch_backend("Agg")
+
+
+def load_messages(folder_path: str, columns: list) -> pd.DataFrame:
+    """
+        Loads columns of the messages table from a binary store
+        (see store.py) or from the chat folder (cached if possible).
+    """
+    if store.is_store(folder_path):
+        return store.open_store(folder_path).messages_frame(columns)
+    return cache.load_messages(folder_path, columns=columns)
+
+
+def load_reactions(folder_path: str, switch: str) -> pd.DataFrame:
+    """
+        Loads reactions table from a binary store (see store.py)
+        or from the chat folder (cached if possible).
+    """
+    if store.is_store(folder_path):
+        return store.open_store(folder_path).reactions_frame(switch)
+    return cache.load_reactions(folder_path, switch)
+
+
+def prepare_data_for_messages_per_period(folder_path: str,
+                                         period: str = "day",
+                                         timezone: str = None) -> pd.DataFrame:
+    """
+        Loads messages table (cached if possible, duplicates are dropped
+        while loading), removes unsent messages and adds `date_local`
+        column truncated to the start of period ["day", "month"]
+        in timezone (local if None).
     """
     # Load data.
     print("Loading data...")
-    data = io.load_group_messages(folder_path)
-
-    # Convert to pd.DataFrame.
-    print("Converting data to pd.DataFrame...")
-    df = pd.DataFrame(data)
-
-    # Remove unnecessary columns.
-    print("Removing unwanted columns...")
-    remove_columns = ["videos", "photos", "reactions", "gifs", "share", "files",
-                      "audio_files", "call_duration", "sticker", "users"]
-    for column in remove_columns:
-        try:
-            df.pop(column)
-        except KeyError:
-            print(f"Failed to drop {column} column")
-
-    # Drop duplicate rows.
-    print("Dropping duplicate rows...")
-    df = df.drop_duplicates()
+    with instrument.stage("load_messages") as stage:
+        df = load_messages(folder_path, ["sender_name", "timestamp_ms", "is_unsent"])
+        stage.rows_out = len(df.index)
+    print(f"Dropped {df.attrs.get('dropped_duplicates', 0)} duplicate messages...")
 
     # Drop entries where messages were unsent.
     print("Dropping unsent messages...")
-    df = df.drop(df[df.is_unsent].index)
+    df = df[~df.is_unsent]
 
     # Format datetimes.
-    print("Formatting datetimes by removing time...")
-    # Normalize dates so that HH:MM:SS are set to 00:00:00.
-    df['date_local'] = df['date_local'].dt.normalize()
+    print(f"Truncating datetimes to {period}...")
+    with instrument.stage("local_dates", len(df.index)):
+        df['date_local'] = io.truncate_dates(
+            io.to_local_datetime(df['timestamp_ms'], timezone), period)
 
     return df
 
@@ -52,108 +207,76 @@ def group_data_for_messages_per_period(df: pd.DataFrame,
     """
     # Group data by sender name and date.
     print("Grouping data by sender name and date...")
-    df1 = pd.DataFrame({'count': df.groupby(
-        ["sender_name", "date_local"]).size()}).reset_index()
-
-    # Prepare dates of the range we will extract data from.
-    if not from_date:
-        min_date = df1.date_local.min()
-    else:
-        min_date = from_date
-    if not to_date:
-        max_date = df1.date_local.max()
-    else:
-        max_date = to_date
-
-    # Remove out of bound dates.
-    df1 = df1[((df1.date_local >= min_date) & (df1.date_local <= max_date))]
-
-    # Find distinct participants.
-    participants = df1.sender_name.unique()
-
-    # Ensure data continuity that there is a record for each day from min_date to max_date.
-    print("Ensuring data continuity for each participant...")
-    while min_date <= max_date:
-        for participant in participants:
-            # Check if entry for the min_date exists.
-            if not ((df1.sender_name == participant) & (df1.date_local == min_date)).any():
-                # Append new entry
-                df1.loc[len(df1.index)] = [participant, min_date, 0]
-        min_date += pd.DateOffset(months=period_months, days=period_days)
-
-    df1 = df1.sort_values(by=["date_local"])
+    return group_data_per_period(df, "sender_name", from_date, to_date,
+                                 period_days, period_months)
 
-    return df1
 
-
-def plot_messages_per_period(df: pd.DataFrame, period: str):
+def plot_messages_per_period(df: pd.DataFrame, period: str, output_file: str = None):
     """
-        period is in ["day", "month"]
+        period is in ["day", "week", "month", "quarter", "year"]
+        Chart is written to output_file if provided, shown otherwise.
     """
-    plt.close("all")
-    participants = df.sender_name.unique()
-    for participant in participants:
-        _df = df.loc[df["sender_name"] == participant]
-
-        x = _df['date_local']
-        y = _df['count']
-
-        plt.plot(x, y, label=participant)
-
-    plt.ylabel(f'Number of messages per {period}')
-    plt.grid(color='lightgrey', linestyle='--', linewidth=1)
-    plt.legend()
-    plt.show()
+    wide = pivot_period_counts(df, "sender_name")
+    get_renderer().render(wide, f'Number of messages per {period}', output_file)
 
 
-def number_of_messages_per_month(folder_path: str, from_date=None, to_date=None):
+def number_of_messages_per_month(folder_path: str, from_date=None, to_date=None, timezone=None, output_file=None):
     """
         Reads Messenger data from specified folder and
         plots the number of messages each participant sent per month.
     """
-    df = prepare_data_for_messages_per_period(folder_path)
-
-    # Set all date days to 1.
-    df['date_local'] = df['date_local'].apply(lambda dt: dt.replace(day=1))
+    df = prepare_data_for_messages_per_period(folder_path, "month", timezone)
 
     df1 = group_data_for_messages_per_period(
         df, from_date, to_date, period_days=0, period_months=1)
 
-    plot_messages_per_period(df1, "month")
+    plot_messages_per_period(df1, "month", output_file)
 
 
-def number_of_messages_per_day(folder_path: str, from_date=None, to_date=None):
+def number_of_messages_per_day(folder_path: str, from_date=None, to_date=None, timezone=None, output_file=None):
     """
         Reads Messenger data from specified folder and
         plots the number of messages each participant sent per day.
     """
-    df = prepare_data_for_messages_per_period(folder_path)
+    df = prepare_data_for_messages_per_period(folder_path, "day", timezone)
 
     df1 = group_data_for_messages_per_period(
         df, from_date, to_date, period_days=1, period_months=0)
 
-    plot_messages_per_period(df1, "day")
+    plot_messages_per_period(df1, "day", output_file)
+
+
+def number_of_messages_per_period(folder_path: str, period: str, from_date=None, to_date=None, timezone=None, output_file=None):
+    """
+        Plots the number of messages each participant sent per period
+        ["day", "week", "month", "quarter", "year"]. Counts come from the
+        persisted rollup index, so messages are only read on the first call.
+    """
+    index = rollup.load_index(folder_path, timezone)
+    df = index.query("messages", from_date, to_date, period)
+
+    plot_messages_per_period(df.rename(columns={"participant": "sender_name"}), period, output_file)
 
 # ---------------- # ---------------- # ---------------- #
 
 # ---------------- # ---------------- # ---------------- #
 
 
-def prepare_data_for_rections_per_period(data: list) -> pd.DataFrame:
+def prepare_data_for_rections_per_period(data: pd.DataFrame,
+                                         period: str = "day",
+                                         timezone: str = None) -> pd.DataFrame:
     """
-        Converts list to pd.DataFrame, removes duplicate entries and 
-        normalizes dates by removing time part of the date. 
+        Takes in reactions table (reactions of duplicate messages are
+        already dropped while loading) and converts timestamps to dates
+        in timezone (local if None) truncated to the start of period
+        ["day", "month"]. 
     """
-    # Convert list to dataframe
-    df = pd.DataFrame(data)
+    df = data.copy()
 
-    # Drop duplicate rows.
-    print("Dropping duplicate rows...")
-    df = df.drop_duplicates()
-
-    print("Formatting datetimes by removing time...")
-    # Normalize dates so that HH:MM:SS are set to 00:00:00.
-    df['date_local'] = df['date_local'].dt.normalize()
+    print(f"Truncating datetimes to {period}...")
+    with instrument.stage("local_dates", len(df.index)):
+        df['date_local'] = io.truncate_dates(
+            io.to_local_datetime(df.pop('timestamp_ms'), timezone), period)
 
     return df
 
@@ -165,117 +288,102 @@ def group_data_for_reactions_per_period(df: pd.DataFrame,
                                         period_months: int) -> pd.DataFrame:
     """
     """
-    # Group data by sender name and date.
+    # Group data by participant and date.
     print("Grouping data by participant and date...")
-    df1 = pd.DataFrame({'count': df.groupby(
-        ["participant", "date_local"]).size()}).reset_index()
-
-    # Prepare dates of the range we will extract data from.
-    if not from_date:
-        min_date = df1.date_local.min()
-    else:
-        min_date = from_date
-    if not to_date:
-        max_date = df1.date_local.max()
-    else:
-        max_date = to_date
-
-    # Remove out of bound dates.
-    df1 = df1[((df1.date_local >= min_date) & (df1.date_local <= max_date))]
-
-    # Find distinct participants.
-    participants = df1.participant.unique()
-
-    # Ensure data continuity that there is a record for each day from min_date to max_date.
-    print("Ensuring data continuity for each participant...")
-    while min_date <= max_date:
-        for participant in participants:
-            # Check if entry for the min_date exists.
-            if not ((df1.participant == participant) & (df1.date_local == min_date)).any():
-                # Append new entry
-                df1.loc[len(df1.index)] = [participant, min_date, 0]
-        min_date += pd.DateOffset(months=period_months, days=period_days)
-
-    df1 = df1.sort_values(by=["date_local"])
-
-    return df1
+    return group_data_per_period(df, "participant", from_date, to_date,
+                                 period_days, period_months)
 
 
-def plot_reactions_per_period(df: pd.DataFrame, period: str, switch: str):
+def plot_reactions_per_period(df: pd.DataFrame, period: str, switch: str, output_file: str = None):
     """
-        period is in ["day", "month"]
+        period is in ["day", "week", "month", "quarter", "year"]
         switch is in ["received, sent]
+        Chart is written to output_file if provided, shown otherwise.
     """
-    plt.close("all")
-    participants = df.participant.unique()
-    for participant in participants:
-        _df = df.loc[df["participant"] == participant]
-
-        x = _df['date_local']
-        y = _df['count']
+    wide = pivot_period_counts(df, "participant")
+    get_renderer().render(wide, f'Number of {switch} reactions per {period}', output_file)
 
-        plt.plot(x, y, label=participant)
 
-    plt.ylabel(f'Number of {switch} reactions per {period}')
-    plt.grid(color='lightgrey', linestyle='--', linewidth=1)
-    plt.legend()
-    plt.show()
-
-
-def number_of_reactions_per_day(folder_path: str, switch: str, from_date=None, to_date=None):
+def number_of_reactions_per_day(folder_path: str, switch: str, from_date=None, to_date=None, timezone=None, output_file=None):
     """
         Reads Messenger data from specified folder and
         plots the number of reactions each participant `swtich`[sent|received] per day.
     """
     # Load reactions.
-    if switch == "sent":
-        data = io.load_group_reactions_sent(folder_path)
-    elif switch == "received":
-        data = io.load_group_reactions_received(folder_path)
-    else:
-        print(
-            f'Bad switch parameter provided: {switch}.\n'
-            f'Please provide one of the valid parameters: [sent|received]')
+    data = load_reactions(folder_path, switch)
 
     # Prepare data.
-    df = prepare_data_for_rections_per_period(data)
+    df = prepare_data_for_rections_per_period(data, "day", timezone)
 
     # Group data.
     df1 = group_data_for_reactions_per_period(
         df, from_date, to_date, period_days=1, period_months=0)
 
     # Plot data.
-    plot_reactions_per_period(df1, "day", switch)
+    plot_reactions_per_period(df1, "day", switch, output_file)
 
 
-def number_of_reactions_per_month(folder_path: str, switch: str, from_date=None, to_date=None):
+def number_of_reactions_per_month(folder_path: str, switch: str, from_date=None, to_date=None, timezone=None, output_file=None):
     """
         Reads Messenger data from specified folder and
         plots the number of reactions each participant `swtich`[sent|received] per day.
     """
     # Load reactions.
-    if switch == "sent":
-        data = io.load_group_reactions_sent(folder_path)
-    elif switch == "received":
-        data = io.load_group_reactions_received(folder_path)
-    else:
-        print(
-            f'Bad switch parameter provided: {switch}.\n'
-            f'Please provide one of the valid parameters: [sent|received]')
+    data = load_reactions(folder_path, switch)
 
     # Prepare data.
-    df = prepare_data_for_rections_per_period(data)
-    # Set all date days to 1.
-    df['date_local'] = df['date_local'].apply(lambda dt: dt.replace(day=1))
+    df = prepare_data_for_rections_per_period(data, "month", timezone)
 
     # Group data.
     df1 = group_data_for_reactions_per_period(
         df, from_date, to_date, period_days=0, period_months=1)
 
     # Plot data.
-    plot_reactions_per_period(df1, "month", switch)
+    plot_reactions_per_period(df1, "month", switch, output_file)
+
+
+def number_of_reactions_per_period(folder_path: str, switch: str, period: str, from_date=None, to_date=None, timezone=None, output_file=None):
+    """
+        Plots the number of reactions each participant `switch`[sent|received]
+        per period ["day", "week", "month", "quarter", "year"] using the
+        persisted rollup index.
+    """
+    if switch not in ("sent", "received"):
+        raise ValueError(
+            f'Bad switch parameter provided: {switch}. '
+            f'Please provide one of the valid parameters: [sent|received]')
+
+    index = rollup.load_index(folder_path, timezone)
+    df = index.query(f"reactions_{switch}", from_date, to_date, period)
+
+    plot_reactions_per_period(df, period, switch, output_file)
 
 
 # ---------------- # ---------------- # ---------------- #
 
 # ---------------- # ---------------- # ---------------- #
+
+
+def render_all(folder_path: str, output_dir: str, fmt: str = "png",
+               from_date=None, to_date=None, timezone=None) -> list:
+    """
+        Headless rendering of every chart of the group stored in folder_path:
+        messages and sent/received reactions per day, week, month and year.
+        Counts come from a single rollup index and charts share one figure.
+        Returns (output_file, render seconds) of each chart.
+    """
+    set_headless()
+    os.makedirs(output_dir, exist_ok=True)
+    index = rollup.load_index(folder_path, timezone)
+    timings_start = len(get_renderer().timings)
+
+    for period in ["day", "week", "month", "year"]:
+        df = index.query("messages", from_date, to_date, period)
+        plot_messages_per_period(df.rename(columns={"participant": "sender_name"}), period,
+                                 os.path.join(output_dir, f"messages_per_{period}.{fmt}"))
+        for switch in ["sent", "received"]:
+            df = index.query(f"reactions_{switch}", from_date, to_date, period)
+            plot_reactions_per_period(df, period, switch, os.path.join(
+                output_dir, f"reactions_{switch}_per_{period}.{fmt}"))
+
+    return get_renderer().timings[timings_start:]
@@ -0,0 +1,226 @@
+import os
+import numpy as np
+import pandas as pd
+import cache
+import data_io as io
+import instrument
+import store
+
+
+METRICS = ("messages", "reactions_sent", "reactions_received")
+
+PERIODS = ("day", "week", "month", "quarter", "year")
+
+
+def period_starts(first_day: np.datetime64, last_day: np.datetime64, period: str) -> np.ndarray:
+    """
+        Returns start days of all periods overlapping [first_day, last_day].
+        Weeks start on Monday, quarters in January, April, July and October.
+    """
+    if period == "day":
+        return np.arange(first_day, last_day + 1, dtype="datetime64[D]")
+    if period == "week":
+        # 1970-01-01 was a Thursday.
+        weekday = (first_day.astype(np.int64) + 3) % 7
+        return np.arange(first_day - weekday, last_day + 1, 7, dtype="datetime64[D]")
+    if period == "month":
+        return np.arange(first_day.astype("datetime64[M]"),
+                         last_day.astype("datetime64[M]") + 1).astype("datetime64[D]")
+    if period == "quarter":
+        first_month = first_day.astype("datetime64[M]")
+        first_month -= first_month.astype(np.int64) % 3
+        return np.arange(first_month, last_day.astype("datetime64[M]") + 1,
+                         3).astype("datetime64[D]")
+    if period == "year":
+        return np.arange(first_day.astype("datetime64[Y]"),
+                         last_day.astype("datetime64[Y]") + 1).astype("datetime64[D]")
+
+    raise ValueError(
+        f'Bad period parameter provided: {period}. '
+        f'Please provide one of the valid parameters: [{"|".join(PERIODS)}]')
+
+
+class RollupIndex():
+    """
+        Daily counts of each metric per participant, stored as prefix sums
+        so that the count of any date range is a difference of two values.
+        Weekly, monthly, quarterly and yearly counts are answered from the
+        same prefix sums in O(number of buckets).
+    """
+
+    def __init__(self, start: np.datetime64, participants: list,
+                 cumulative: np.ndarray, timezone: str = None):
+        # First day covered by the index
+        self.start = np.datetime64(start, "D")
+        self.participants = list(participants)
+        # cumulative[metric, participant, d] is the count before day start + d
+        self.cumulative = cumulative
+        self.timezone = timezone
+
+    @property
+    def num_days(self) -> int:
+        return self.cumulative.shape[2] - 1
+
+    @property
+    def end(self) -> np.datetime64:
+        # Last day covered by the index
+        return self.start + self.num_days - 1
+
+    @classmethod
+    def build(cls, folder_path: str, timezone: str = None, cache_dir: str = None) -> "RollupIndex":
+        """
+            Takes in folder_path where the Messenger group chats are stored
+            and builds the index of sent messages (unsent ones excluded)
+            and sent/received reactions per day in timezone (local if None).
+        """
+        if store.is_store(folder_path):
+            messages, reactions = store.open_store(folder_path).tables()
+        else:
+            messages, reactions = cache.load_tables(
+                folder_path, cache_dir,
+                message_columns=["sender_name", "timestamp_ms", "is_unsent"],
+                reaction_columns=["actor", "sender_name", "timestamp_ms"])
+        messages = messages[~messages.is_unsent]
+
+        def days(timestamps_ms: pd.Series) -> np.ndarray:
+            dates = io.to_local_datetime(timestamps_ms, timezone)
+            return dates.to_numpy().astype("datetime64[D]")
+
+        message_days = days(messages["timestamp_ms"])
+        reaction_days = days(reactions["timestamp_ms"])
+        all_days = np.concatenate([message_days, reaction_days])
+        participants = sorted(set(messages["sender_name"]) | set(reactions["actor"])
+                              | set(reactions["sender_name"]))
+
+        if len(all_days) == 0:
+            return cls(np.datetime64("1970-01-01"), participants,
+                       np.zeros((len(METRICS), len(participants), 1), dtype=np.int64),
+                       timezone)
+
+        start = all_days.min()
+        num_days = int((all_days.max() - start).astype(np.int64)) + 1
+        index = {name: i for i, name in enumerate(participants)}
+        counts = np.zeros((len(METRICS), len(participants), num_days), dtype=np.int64)
+
+        for metric, names, metric_days in [
+                ("messages", messages["sender_name"], message_days),
+                ("reactions_sent", reactions["actor"], reaction_days),
+                ("reactions_received", reactions["sender_name"], reaction_days)]:
+            rows = names.map(index).to_numpy(dtype=np.int64)
+            columns = (metric_days - start).astype(np.int64)
+            counts[METRICS.index(metric)] = np.bincount(
+                rows * num_days + columns,
+                minlength=len(participants) * num_days).reshape(len(participants), num_days)
+
+        cumulative = np.zeros((len(METRICS), len(participants), num_days + 1), dtype=np.int64)
+        np.cumsum(counts, axis=2, out=cumulative[:, :, 1:])
+
+        return cls(start, participants, cumulative, timezone)
+
+    def save(self, file_name: str):
+        """
+            Saves the index to a NumPy .npz file.
+        """
+        np.savez_compressed(
+            file_name, start=np.array(self.start), participants=np.array(self.participants),
+            cumulative=self.cumulative, timezone=np.array(self.timezone or ""))
+
+    @classmethod
+    def load(cls, file_name: str) -> "RollupIndex":
+        """
+            Loads the index saved with save().
+        """
+        with np.load(file_name) as data:
+            return cls(data["start"][()], data["participants"].tolist(),
+                       data["cumulative"], str(data["timezone"]) or None)
+
+    def day_range(self, from_date=None, to_date=None) -> tuple:
+        """
+            Returns (first, last) day of the range, the whole index if None.
+        """
+        first_day = self.start if from_date is None else np.datetime64(
+            pd.Timestamp(from_date).date(), "D")
+        last_day = self.end if to_date is None else np.datetime64(
+            pd.Timestamp(to_date).date(), "D")
+        return first_day, last_day
+
+    def offsets(self, days: np.ndarray) -> np.ndarray:
+        """
+            Returns prefix sum positions of days, clipped to the index.
+        """
+        return np.clip((days - self.start).astype(np.int64), 0, self.num_days)
+
+    def total(self, metric: str, from_date=None, to_date=None) -> dict:
+        """
+            Returns the count of metric of each participant
+            from from_date to to_date (both inclusive).
+        """
+        first_day, last_day = self.day_range(from_date, to_date)
+        cumulative = self.cumulative[METRICS.index(metric)]
+        counts = (cumulative[:, self.offsets(max(last_day + 1, first_day))]
+                  - cumulative[:, self.offsets(first_day)])
+        return dict(zip(self.participants, counts.tolist()))
+
+    def query(self, metric: str, from_date=None, to_date=None,
+              period: str = "day") -> pd.DataFrame:
+        """
+            Returns the count of metric per participant per period
+            ["day", "week", "month", "quarter", "year"] from from_date
+            to to_date (both inclusive, whole index if None) as a
+            participant, date_local, count pd.DataFrame.
+            Buckets at the edges only count days inside the range.
+            Participants with no metric in the range are left out.
+        """
+        if metric not in METRICS:
+            raise ValueError(
+                f'Bad metric parameter provided: {metric}. '
+                f'Please provide one of the valid parameters: [{"|".join(METRICS)}]')
+
+        first_day, last_day = self.day_range(from_date, to_date)
+        starts = period_starts(first_day, last_day, period)
+        # Bucket i covers [starts[i], starts[i + 1]) clipped to [first_day, last_day].
+        lower = np.maximum(starts, first_day)
+        upper = np.minimum(np.append(starts[1:], last_day + 1), last_day + 1)
+
+        cumulative = self.cumulative[METRICS.index(metric)]
+        counts = cumulative[:, self.offsets(upper)] - cumulative[:, self.offsets(lower)]
+
+        # Participants without metric in the range (e.g. ones who only
+        # reacted, for messages) are left out, as in grouped raw data.
+        active = counts.sum(axis=1) > 0
+        participants = np.array(self.participants, dtype=object)[active]
+        counts = counts[active]
+
+        return pd.DataFrame({
+            "participant": np.repeat(participants, len(starts)),
+            "date_local": np.tile(starts, len(participants)).astype("datetime64[ns]"),
+            "count": counts.ravel()
+        })
+
+
+def load_index(folder_path: str, timezone: str = None, cache_dir: str = None) -> RollupIndex:
+    """
+        Returns the rollup index of folder_path persisted next to its
+        cached tables. The index is rebuilt if any *.json file of the
+        folder was added, deleted or changed since it was built
+        (see cache.sources_unchanged) or it was built for another timezone.
+    """
+    directory = cache.folder_cache_dir(folder_path, cache_dir)
+    index_file = os.path.join(directory, "rollup.npz")
+    sources = io.group_files(folder_path)
+    if store.is_store(folder_path):
+        sources = [os.path.join(folder_path, store.MANIFEST_FILE)]
+
+    if cache.sources_unchanged(index_file, sources):
+        index = RollupIndex.load(index_file)
+        if index.timezone == timezone:
+            return index
+
+    # Recorded before building, so files changed meanwhile trigger a rebuild
+    manifest = cache.source_manifest(sources)
+    with instrument.stage("build_rollup"):
+        index = RollupIndex.build(folder_path, timezone, cache_dir)
+    os.makedirs(directory, exist_ok=True)
+    index.save(index_file)
+    cache.record_sources(index_file, manifest)
+    return index
@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+import data_io as io
+import store
+
+
+# Messages further apart than this start a new session by default
+IDLE_MINUTES = 30
+
+QUANTILES = {"median": 0.5, "p90": 0.9}
+
+
+class Timeline():
+    """
+        Sent (not unsent) messages of a table (data_io.MessageTable or
+        store.Store) sorted once by timestamp_ms, with session boundaries
+        after every idle gap longer than idle_minutes.
+    """
+
+    def __init__(self, table, idle_minutes: float = IDLE_MINUTES):
+        sent = np.asarray(table.is_unsent) == 0
+        timestamps = np.asarray(table.timestamp_ms)[sent]
+        senders = np.asarray(table.sender)[sent]
+        order = np.argsort(timestamps, kind="stable")
+
+        self.names = table.names
+        self.timestamp_ms = timestamps[order]
+        self.sender = senders[order].astype(np.int64)
+        self.idle_ms = int(idle_minutes * 60000)
+
+        # gaps[i] is the time between message i and message i + 1
+        self.gaps = np.diff(self.timestamp_ms)
+        # Index of the first message of each session
+        self.session_starts = np.flatnonzero(
+            np.concatenate([[len(order) > 0], self.gaps > self.idle_ms]))
+
+    def __len__(self) -> int:
+        return len(self.timestamp_ms)
+
+    def replies(self) -> tuple:
+        """
+            Returns (replier, replied_to, latency_ms) of every reply,
+            i.e. a message following a message of another participant
+            in the same session.
+        """
+        is_reply = (self.sender[1:] != self.sender[:-1]) & (self.gaps <= self.idle_ms)
+        rows = np.nonzero(is_reply)[0]
+        return self.sender[rows + 1], self.sender[rows], self.gaps[rows]
+
+    def sessions(self, timezone: str = None) -> pd.DataFrame:
+        """
+            Returns start, end (in timezone, local if None), messages,
+            participants and starter of each session.
+        """
+        starts = self.session_starts
+        ends = np.append(starts[1:], len(self))[:len(starts)] - 1
+        session = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(self))))
+
+        # Distinct (session, sender) pairs give the number of participants per session
+        pairs = np.unique(session * len(self.names) + self.sender)
+        participants = np.bincount(pairs // max(len(self.names), 1), minlength=len(starts))
+
+        return pd.DataFrame({
+            "start": io.to_local_datetime(self.timestamp_ms[starts], timezone),
+            "end": io.to_local_datetime(self.timestamp_ms[ends], timezone),
+            "messages": ends - starts + 1,
+            "participants": participants,
+            "starter": np.array(self.names, dtype=object)[self.sender[starts]]
+        })
+
+
+def reply_latency(timeline: Timeline) -> pd.DataFrame:
+    """
+        Returns the number of replies and mean, median and p90 reply
+        latency (seconds) of each replier, replied_to pair.
+        Replies are sorted once by pair and latency, quantiles are
+        interpolated from the sorted segments (same as np.quantile).
+    """
+    replier, replied_to, latency = timeline.replies()
+    num_names = len(timeline.names)
+    pairs = replier * num_names + replied_to
+
+    order = np.lexsort((latency, pairs))
+    pairs, latency = pairs[order], latency[order]
+    unique_pairs, first, counts = np.unique(pairs, return_index=True, return_counts=True)
+    sums = np.add.reduceat(latency, first) if len(first) else np.zeros(0)
+
+    df = pd.DataFrame({
+        "replier": np.array(timeline.names, dtype=object)[unique_pairs // num_names],
+        "replied_to": np.array(timeline.names, dtype=object)[unique_pairs % num_names],
+        "replies": counts,
+        "mean_s": sums / counts / 1000
+    })
+    for name, quantile in QUANTILES.items():
+        # Linear interpolation between the two nearest sorted items, as np.quantile
+        position = quantile * (counts - 1)
+        lower = latency[first + np.floor(position).astype(np.int64)]
+        upper = latency[first + np.ceil(position).astype(np.int64)]
+        df[f"{name}_s"] = (lower + (position - np.floor(position)) * (upper - lower)) / 1000
+
+    return df
+
+
+def session_starters(timeline: Timeline) -> dict:
+    """
+        Returns the number of sessions each participant started.
+    """
+    counts = np.bincount(timeline.sender[timeline.session_starts], minlength=len(timeline.names))
+    return dict(zip(timeline.names, counts.tolist()))
+
+
+def load_timeline(folder_path: str, idle_minutes: float = IDLE_MINUTES) -> Timeline:
+    """
+        Loads messages of folder_path (a chat folder or a binary store,
+        see store.py) without duplicates and sorts them into a Timeline.
+    """
+    if store.is_store(folder_path):
+        table = store.open_store(folder_path)
+    else:
+        table = io.load_group_table(folder_path, deduplicator=io.Deduplicator())
+    return Timeline(table, idle_minutes)
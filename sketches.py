@@ -0,0 +1,431 @@
+import base64
+import hashlib
+import heapq
+import math
+import random
+from functools import lru_cache
+import numpy as np
+import data_io as io
+
+
+@lru_cache(maxsize=65536)
+def hash64(value: str) -> int:
+    """
+        Returns a 64-bit hash of value. Cached, since words repeat a lot.
+    """
+    return int.from_bytes(
+        hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def encode_array(values: np.ndarray) -> str:
+    return base64.b64encode(values.tobytes()).decode("ascii")
+
+
+def decode_array(text: str, dtype, shape: tuple) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(text), dtype=dtype).reshape(shape).copy()
+
+
+class HyperLogLog():
+    """
+        Estimates the number of distinct strings added.
+        Uses 2**precision one byte registers (16 KB for precision 14)
+        and has a relative standard error of 1.04 / sqrt(2**precision),
+        i.e. 0.81% for precision 14. Small counts are exact-ish thanks
+        to linear counting.
+    """
+
+    def __init__(self, precision: int = 14):
+        self.precision = precision
+        self.registers = np.zeros(2 ** precision, dtype=np.uint8)
+
+    def add(self, value: str):
+        hashed = hash64(value)
+        register = hashed >> (64 - self.precision)
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        # Position of the leftmost 1 bit of the remaining bits
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[register]:
+            self.registers[register] = rank
+
+    def merge(self, other: "HyperLogLog"):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small counts
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def state(self) -> dict:
+        return {"precision": self.precision, "registers": encode_array(self.registers)}
+
+    @classmethod
+    def from_state(cls, state: dict) -> "HyperLogLog":
+        sketch = cls(state["precision"])
+        sketch.registers = decode_array(state["registers"], np.uint8, (2 ** sketch.precision,))
+        return sketch
+
+
+class CountMinSketch():
+    """
+        Estimates how many times a string was added. Estimates never
+        undercount and overcount by at most e / width * (total count)
+        with probability 1 - exp(-depth), i.e. 0.13% of the total for
+        width 2048 with probability 98% for depth 4.
+    """
+
+    def __init__(self, width: int = 2048, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self.counts = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+
+    def columns(self, value: str) -> list:
+        # Row hashes are combinations of two halves of a 64-bit hash
+        hashed = hash64(value)
+        low, high = hashed & 0xffffffff, hashed >> 32
+        return [(low + row * high) % self.width for row in range(self.depth)]
+
+    def add(self, value: str, count: int = 1):
+        self.counts[np.arange(self.depth), self.columns(value)] += count
+        self.total += count
+
+    def estimate(self, value: str) -> int:
+        return int(self.counts[np.arange(self.depth), self.columns(value)].min())
+
+    def merge(self, other: "CountMinSketch"):
+        self.counts += other.counts
+        self.total += other.total
+
+    def state(self) -> dict:
+        return {"width": self.width, "depth": self.depth, "total": self.total,
+                "counts": encode_array(self.counts)}
+
+    @classmethod
+    def from_state(cls, state: dict) -> "CountMinSketch":
+        sketch = cls(state["width"], state["depth"])
+        sketch.counts = decode_array(state["counts"], np.int64, (sketch.depth, sketch.width))
+        sketch.total = state["total"]
+        return sketch
+
+
+def largest_counters(counters: dict, n: int) -> list:
+    """
+        Returns the n (item, [count, error]) entries with the largest
+        counts, ties broken by item.
+    """
+    return heapq.nsmallest(n, counters.items(), key=lambda entry: (-entry[1][0], entry[0]))
+
+
+class SpaceSaving():
+    """
+        Keeps the (approximately) most frequent of the strings added
+        using at most k counters. Every string added more than
+        (total count) / k times is kept, and a kept count overestimates
+        the true count by at most its error (itself at most total / k).
+    """
+
+    def __init__(self, k: int = 100):
+        self.k = k
+        # item -> [count, error]
+        self.counters = {}
+        # (count, item) entries, some stale, to find the smallest counter
+        self.heap = []
+        self.total = 0
+
+    def add(self, item: str, count: int = 1):
+        self.total += count
+        counter = self.counters.get(item)
+
+        if counter is None:
+            if len(self.counters) < self.k:
+                counter = self.counters[item] = [0, 0]
+            else:
+                # Replace the smallest counter, its count is the new error
+                smallest, evicted = self.pop_smallest()
+                del self.counters[evicted]
+                counter = self.counters[item] = [smallest, smallest]
+
+        counter[0] += count
+        heapq.heappush(self.heap, (counter[0], item))
+        if len(self.heap) > 4 * self.k:
+            self.heap = [(counter[0], item) for item, counter in self.counters.items()]
+            heapq.heapify(self.heap)
+
+    def pop_smallest(self) -> tuple:
+        while True:
+            count, item = heapq.heappop(self.heap)
+            counter = self.counters.get(item)
+            if counter is not None and counter[0] == count:
+                return count, item
+
+    def merge(self, other: "SpaceSaving"):
+        """
+            Merges counters of two sketches (Agarwal et al., Mergeable
+            Summaries): items missing from a full sketch are counted
+            with its smallest count, then the k largest counters are kept.
+        """
+        own_min = min((c[0] for c in self.counters.values()), default=0) \
+            if len(self.counters) >= self.k else 0
+        other_min = min((c[0] for c in other.counters.values()), default=0) \
+            if len(other.counters) >= other.k else 0
+
+        merged = {}
+        # Sorted, so the result does not depend on set order (PYTHONHASHSEED)
+        for item in sorted(set(self.counters) | set(other.counters)):
+            count, error = self.counters.get(item, [own_min, own_min])
+            other_count, other_error = other.counters.get(item, [other_min, other_min])
+            merged[item] = [count + other_count, error + other_error]
+
+        self.counters = dict(largest_counters(merged, self.k))
+        self.heap = [(counter[0], item) for item, counter in self.counters.items()]
+        heapq.heapify(self.heap)
+        self.total += other.total
+
+    def top(self, n: int = None) -> list:
+        """
+            Returns [item, count, error] of the n largest counters.
+        """
+        largest = largest_counters(self.counters, n or self.k)
+        return [[item, count, error] for item, (count, error) in largest]
+
+    def state(self) -> dict:
+        return {"k": self.k, "total": self.total, "counters": self.top()}
+
+    @classmethod
+    def from_state(cls, state: dict) -> "SpaceSaving":
+        sketch = cls(state["k"])
+        sketch.counters = {item: [count, error] for item, count, error in state["counters"]}
+        sketch.heap = [(counter[0], item) for item, counter in sketch.counters.items()]
+        heapq.heapify(sketch.heap)
+        sketch.total = state["total"]
+        return sketch
+
+
+class TopN():
+    """
+        Keeps the n items with the largest keys exactly, in O(n) memory.
+    """
+
+    def __init__(self, n: int = 10):
+        self.n = n
+        self.heap = []
+
+    def add(self, key, item):
+        entry = (key, item)
+        if len(self.heap) < self.n:
+            heapq.heappush(self.heap, entry)
+        elif entry > self.heap[0]:
+            heapq.heapreplace(self.heap, entry)
+
+    def merge(self, other: "TopN"):
+        for key, item in other.heap:
+            self.add(key, item)
+
+    def top(self) -> list:
+        return sorted(self.heap, reverse=True)
+
+    def state(self) -> dict:
+        return {"n": self.n, "heap": [list(entry) for entry in self.heap]}
+
+    @classmethod
+    def from_state(cls, state: dict) -> "TopN":
+        sketch = cls(state["n"])
+        sketch.heap = [(key, tuple(item)) for key, item in state["heap"]]
+        heapq.heapify(sketch.heap)
+        return sketch
+
+
+class KLLSketch():
+    """
+        Estimates quantiles of added numbers (Karnin, Lang, Liberty)
+        keeping O(k) of them. The rank error of a quantile is about
+        1.7 / k (under 1% for k = 200) with high probability.
+    """
+
+    def __init__(self, k: int = 200, seed: int = 0):
+        self.k = k
+        self.compactors = [[]]
+        self.count = 0
+        self.random = random.Random(seed)
+
+    def capacity(self, level: int) -> int:
+        # Lower levels get geometrically (2/3) smaller capacities
+        height = len(self.compactors)
+        return max(2, int(math.ceil(self.k * (2 / 3) ** (height - level - 1))))
+
+    def size(self) -> int:
+        return sum(len(compactor) for compactor in self.compactors)
+
+    def max_size(self) -> int:
+        return sum(self.capacity(level) for level in range(len(self.compactors)))
+
+    def add(self, value):
+        self.compactors[0].append(value)
+        self.count += 1
+        if len(self.compactors[0]) >= self.capacity(0):
+            self.compress()
+
+    def compress(self):
+        """
+            Halves full compactors, promoting every other sorted item
+            (random offset) one level up with twice the weight.
+        """
+        for level in range(len(self.compactors)):
+            if len(self.compactors[level]) >= self.capacity(level):
+                if level + 1 == len(self.compactors):
+                    self.compactors.append([])
+                compactor = sorted(self.compactors[level])
+                # Odd item stays, so no weight is lost
+                kept = [compactor.pop()] if len(compactor) % 2 else []
+                offset = self.random.randint(0, 1)
+                self.compactors[level + 1].extend(compactor[offset::2])
+                self.compactors[level] = kept
+                if self.size() < self.max_size():
+                    break
+
+    def merge(self, other: "KLLSketch"):
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append([])
+        for level, compactor in enumerate(other.compactors):
+            self.compactors[level].extend(compactor)
+        self.count += other.count
+        while self.size() >= self.max_size():
+            self.compress()
+
+    def quantiles(self, fractions: list) -> list:
+        """
+            Returns estimated values at fractions (0..1) of sorted values.
+        """
+        items = [(value, 2 ** level)
+                 for level, compactor in enumerate(self.compactors) for value in compactor]
+        if not items:
+            return [None for _ in fractions]
+
+        items.sort()
+        weights = np.cumsum([weight for _, weight in items])
+        positions = np.searchsorted(weights, [fraction * weights[-1] for fraction in fractions])
+        return [items[min(position, len(items) - 1)][0] for position in positions]
+
+    def state(self) -> dict:
+        return {"k": self.k, "count": self.count, "compactors": self.compactors}
+
+    @classmethod
+    def from_state(cls, state: dict) -> "KLLSketch":
+        sketch = cls(state["k"])
+        sketch.compactors = [list(compactor) for compactor in state["compactors"]]
+        sketch.count = state["count"]
+        return sketch
+
+
+# Quantiles of message length reported by MessageSketches
+LENGTH_QUANTILES = {"p50": 0.5, "p90": 0.9, "p99": 0.99}
+
+
+class MessageSketches():
+    """
+        Bounded memory statistics of message content for exports too
+        large to count exactly: distinct words (overall and per
+        participant), most frequent words, most reacted messages and
+        message length quantiles (overall and per participant).
+        Sketches of separate files or workers are combined with merge().
+    """
+
+    def __init__(self, top_words: int = 100, top_messages: int = 10):
+        self.distinct_words = HyperLogLog()
+        self.participant_words = {}
+        self.word_counts = CountMinSketch()
+        self.frequent_words = SpaceSaving(top_words)
+        self.most_reacted = TopN(top_messages)
+        self.lengths = KLLSketch()
+        self.participant_lengths = {}
+
+    def add(self, message: dict):
+        content = message.get("content")
+        sender = message["sender_name"]
+
+        reactions = len(message.get("reactions", ()))
+        if reactions:
+            self.most_reacted.add(reactions, (message["timestamp_ms"], sender, content or ""))
+
+        if content is None:
+            return
+
+        self.lengths.add(len(content))
+        if sender not in self.participant_lengths:
+            self.participant_lengths[sender] = KLLSketch()
+            self.participant_words[sender] = HyperLogLog(precision=12)
+        self.participant_lengths[sender].add(len(content))
+
+        participant_words = self.participant_words[sender]
+        for word in io.tokenize(content):
+            self.distinct_words.add(word)
+            participant_words.add(word)
+            self.word_counts.add(word)
+            self.frequent_words.add(word)
+
+    def merge(self, other: "MessageSketches"):
+        self.distinct_words.merge(other.distinct_words)
+        self.word_counts.merge(other.word_counts)
+        self.frequent_words.merge(other.frequent_words)
+        self.most_reacted.merge(other.most_reacted)
+        self.lengths.merge(other.lengths)
+        for sender, lengths in other.participant_lengths.items():
+            if sender in self.participant_lengths:
+                self.participant_lengths[sender].merge(lengths)
+                self.participant_words[sender].merge(other.participant_words[sender])
+            else:
+                self.participant_lengths[sender] = lengths
+                self.participant_words[sender] = other.participant_words[sender]
+
+    def word_count(self, word: str) -> int:
+        """
+            Returns the estimated number of uses of word (never less than the true count).
+        """
+        return self.word_counts.estimate(word.lower())
+
+    def state(self) -> dict:
+        return {
+            "distinct_words": self.distinct_words.state(),
+            "participant_words": {sender: sketch.state()
+                                  for sender, sketch in self.participant_words.items()},
+            "word_counts": self.word_counts.state(),
+            "frequent_words": self.frequent_words.state(),
+            "most_reacted": self.most_reacted.state(),
+            "lengths": self.lengths.state(),
+            "participant_lengths": {sender: sketch.state()
+                                    for sender, sketch in self.participant_lengths.items()}
+        }
+
+    def load_state(self, state: dict):
+        self.distinct_words = HyperLogLog.from_state(state["distinct_words"])
+        self.participant_words = {sender: HyperLogLog.from_state(sketch)
+                                  for sender, sketch in state["participant_words"].items()}
+        self.word_counts = CountMinSketch.from_state(state["word_counts"])
+        self.frequent_words = SpaceSaving.from_state(state["frequent_words"])
+        self.most_reacted = TopN.from_state(state["most_reacted"])
+        self.lengths = KLLSketch.from_state(state["lengths"])
+        self.participant_lengths = {sender: KLLSketch.from_state(sketch)
+                                    for sender, sketch in state["participant_lengths"].items()}
+
+    def result(self) -> dict:
+        def quantiles(sketch: KLLSketch) -> dict:
+            return dict(zip(LENGTH_QUANTILES, sketch.quantiles(list(LENGTH_QUANTILES.values()))))
+
+        return {
+            "distinct_words": self.distinct_words.count(),
+            "distinct_words_per_participant": {
+                sender: sketch.count() for sender, sketch in self.participant_words.items()},
+            "top_words": self.frequent_words.top(),
+            "most_reacted_messages": [
+                {"reactions": reactions, "timestamp_ms": timestamp,
+                 "sender_name": sender, "content": content}
+                for reactions, (timestamp, sender, content) in self.most_reacted.top()],
+            "length_quantiles": quantiles(self.lengths),
+            "length_quantiles_per_participant": {
+                sender: quantiles(sketch) for sender, sketch in self.participant_lengths.items()}
+        }
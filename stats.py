@@ -1,3 +1,7 @@
+from typing import Iterable
+import instrument
+
+
 def add_to_key(obj, key, add):
     if key not in obj:
         obj[key] = add
@@ -5,39 +9,41 @@ def add_to_key(obj, key, add):
         obj[key] += add
 
 
-def number_of_messages(messages: list) -> int:
+def count_message(ret_data: dict, total: dict, message: dict):
     """
-        Returns stats about number of messages each participant has send.
-        Also returns totals of the messages sent.
+        Adds a single message to the per participant stats in ret_data.
+        Call durations are added to total.
     """
-    ret_data = {}
-    total = {}
+    sender = message["sender_name"]
 
-    for message in messages:
-        sender = message["sender_name"]
+    # Init participant
+    if sender not in ret_data:
+        ret_data[sender] = {}
 
-        # Init participant
-        if sender not in ret_data:
-            ret_data[sender] = {}
+    # Total messages
+    add_to_key(ret_data[sender], "messages", 1)
 
-        # Total messages
-        add_to_key(ret_data[sender], "messages", 1)
+    # Number of photos
+    if "photos" in message:
+        num_photos = len(message["photos"])
+        add_to_key(ret_data[sender], "photos", num_photos)
 
-        # Number of photos
-        if "photos" in message:
-            num_photos = len(message["photos"])
-            add_to_key(ret_data[sender], "photos", num_photos)
+    # Number of videos
+    if "videos" in message:
+        num_videos = len(message["videos"])
+        add_to_key(ret_data[sender], "videos", num_videos)
 
-        # Number of videos
-        if "videos" in message:
-            num_videos = len(message["videos"])
-            add_to_key(ret_data[sender], "videos", num_videos)
+    # Number of calls
+    if message["type"] == "Call":
+        add_to_key(ret_data[sender], "calls", 1)
+        add_to_key(total, "call_duration", message["call_duration"])
 
-        # Number of calls
-        if message["type"] == "Call":
-            add_to_key(ret_data[sender], "calls", 1)
-            add_to_key(total, "call_duration", message["call_duration"])
 
+def add_totals(ret_data: dict, total: dict) -> dict:
+    """
+        Sums per participant stats into total and stores it
+        under the "_total" key of ret_data.
+    """
     for name in ret_data:
         for key in ret_data[name]:
             add_to_key(total, key, ret_data[name][key])
@@ -46,3 +52,85 @@ def number_of_messages(messages: list) -> int:
         ret_data["_total"] = total
 
     return ret_data
+
+
+def number_of_messages(messages: Iterable[dict]) -> dict:
+    """
+        Returns stats about number of messages each participant has send.
+        Also returns totals of the messages sent.
+        messages can be any iterable, e.g. data_io.iter_group_messages,
+        so the full message list never has to be built.
+    """
+    ret_data = {}
+    total = {}
+
+    with instrument.stage("number_of_messages") as stage:
+        num_messages = 0
+        for message in messages:
+            count_message(ret_data, total, message)
+            num_messages += 1
+        stage.rows_in = num_messages
+        stage.rows_out = len(ret_data)
+
+    return add_totals(ret_data, total)
+
+
+def number_of_messages_table(table) -> dict:
+    """
+        Same as number_of_messages, but counts a data_io.MessageTable
+        or a store.Store.
+    """
+    ret_data = {}
+    total = {}
+    call = table.type_index.get("Call")
+
+    with instrument.stage("number_of_messages_table", len(table)) as stage:
+        for sender, type_id, num_photos, num_videos, call_duration in zip(
+                table.sender.tolist(), table.type.tolist(), table.photos.tolist(),
+                table.videos.tolist(), table.call_duration.tolist()):
+            sender = table.names[sender]
+
+            # Init participant
+            if sender not in ret_data:
+                ret_data[sender] = {}
+
+            # Total messages
+            add_to_key(ret_data[sender], "messages", 1)
+
+            # Number of photos
+            if num_photos >= 0:
+                add_to_key(ret_data[sender], "photos", num_photos)
+
+            # Number of videos
+            if num_videos >= 0:
+                add_to_key(ret_data[sender], "videos", num_videos)
+
+            # Number of calls
+            if type_id == call:
+                add_to_key(ret_data[sender], "calls", 1)
+                add_to_key(total, "call_duration", call_duration)
+
+        stage.rows_out = len(ret_data)
+
+    return add_totals(ret_data, total)
+
+
+def approximate_stats(messages: Iterable[dict]) -> dict:
+    """
+        Returns bounded memory estimates of distinct words, most frequent
+        words, most reacted messages and message length quantiles
+        (see sketches.MessageSketches for their errors).
+        Meant for exports too large to count these exactly.
+    """
+    import sketches
+
+    message_sketches = sketches.MessageSketches()
+
+    with instrument.stage("approximate_stats") as stage:
+        num_messages = 0
+        for message in messages:
+            message_sketches.add(message)
+            num_messages += 1
+        stage.rows_in = num_messages
+
+    return message_sketches.result()
@@ -0,0 +1,259 @@
+import argparse
+import json
+import os
+import sys
+from typing import Iterable, TYPE_CHECKING
+import numpy as np
+import data_io as io
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+# Bumped whenever the layout of stored columns changes.
+STORE_VERSION = 1
+
+MANIFEST_FILE = "store.json"
+
+# Fixed-width columns, one file each: message columns have one item
+# per message, reaction columns one item per reaction.
+MESSAGE_COLUMNS = {
+    "timestamp_ms": np.int64,
+    "sender": np.uint32,
+    "type": np.uint8,
+    "flags": np.uint8,
+    "photos": np.int32,
+    "videos": np.int32,
+    "call_duration": np.int64,
+    # content of message i is content.bin[content_offsets[i]:content_offsets[i + 1]]
+    "content_offsets": np.int64
+}
+
+REACTION_COLUMNS = {
+    "reaction_message": np.uint32,
+    "reaction_actor": np.uint32,
+    "reaction": np.uint32
+}
+
+# Bits of the flags column
+UNSENT = 1
+HAS_CONTENT = 2
+
+
+def categorical(codes: np.ndarray, categories: list) -> "pd.Categorical":
+    """
+        Returns codes into a string table as a pd.Categorical with
+        sorted categories, as cached tables have.
+    """
+    import pandas as pd
+
+    values = pd.Categorical.from_codes(codes.astype(np.int32), categories)
+    return values.reorder_categories(sorted(categories))
+
+
+def is_store(path: str) -> bool:
+    """
+        Returns True if path is a directory written by write_store.
+    """
+    return os.path.isfile(os.path.join(path, MANIFEST_FILE))
+
+
+def write_store(messages: Iterable[dict], store_path: str) -> int:
+    """
+        Writes prepared messages (e.g. data_io.iter_group_messages) to
+        store_path directory: a .npy file per fixed-width column, content
+        of all messages in a single utf-8 blob and string tables of
+        names, types and reactions in store.json.
+        Returns the number of written messages.
+    """
+    table = io.MessageTable()
+    offsets = [0]
+    flags = []
+    os.makedirs(store_path, exist_ok=True)
+
+    with open(os.path.join(store_path, "content.bin"), "wb") as content_file:
+        for message in messages:
+            table.append(message)
+            content = message.get("content")
+            flag = UNSENT if message.get("is_unsent", False) else 0
+            if content is not None:
+                flag |= HAS_CONTENT
+                encoded = content.encode("utf-8")
+                content_file.write(encoded)
+                offsets.append(offsets[-1] + len(encoded))
+            else:
+                offsets.append(offsets[-1])
+            flags.append(flag)
+
+    columns = {
+        "timestamp_ms": table.timestamp_ms,
+        "sender": table.sender,
+        "type": table.type,
+        "flags": flags,
+        "photos": table.photos,
+        "videos": table.videos,
+        "call_duration": table.call_duration,
+        "content_offsets": offsets,
+        "reaction_message": table.reaction_message,
+        "reaction_actor": table.reaction_actor,
+        "reaction": table.reaction
+    }
+    for name, dtype in {**MESSAGE_COLUMNS, **REACTION_COLUMNS}.items():
+        np.save(os.path.join(store_path, f"{name}.npy"), np.asarray(columns[name], dtype=dtype))
+
+    # Manifest is written last, so an interrupted write is not a store.
+    with open(os.path.join(store_path, MANIFEST_FILE), "w") as outfile:
+        json.dump({
+            "version": STORE_VERSION,
+            "messages": len(table),
+            "reactions": len(table.reaction),
+            "names": table.names,
+            "types": table.types,
+            "reaction_names": table.reaction_names
+        }, outfile)
+
+    return len(table)
+
+
+class Store():
+    """
+        Read-only view of a store written by write_store. Columns are
+        memory-mapped NumPy arrays, so opening a store does not read it.
+        Has the same column and string table attributes as
+        data_io.MessageTable, so it can be passed to
+        stats.number_of_messages_table and ReactionCounter.count_table.
+    """
+
+    def __init__(self, store_path: str):
+        with open(os.path.join(store_path, MANIFEST_FILE), "r") as infile:
+            manifest = json.load(infile)
+        if manifest["version"] != STORE_VERSION:
+            raise ValueError(
+                f'Bad store version: {manifest["version"]}. '
+                f'Please rewrite the store with version {STORE_VERSION}.')
+
+        self.path = store_path
+        self.names = manifest["names"]
+        self.name_index = {name: i for i, name in enumerate(self.names)}
+        self.types = manifest["types"]
+        self.type_index = {name: i for i, name in enumerate(self.types)}
+        self.reaction_names = manifest["reaction_names"]
+        self.reaction_index = {name: i for i, name in enumerate(self.reaction_names)}
+
+        for name in {**MESSAGE_COLUMNS, **REACTION_COLUMNS}:
+            setattr(self, name, np.load(os.path.join(store_path, f"{name}.npy"), mmap_mode="r"))
+
+        content_file = os.path.join(store_path, "content.bin")
+        if os.path.getsize(content_file):
+            self.content_blob = np.memmap(content_file, dtype=np.uint8, mode="r")
+        else:
+            # Empty files can not be memory-mapped
+            self.content_blob = np.zeros(0, dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return len(self.timestamp_ms)
+
+    @property
+    def is_unsent(self) -> np.ndarray:
+        return (self.flags & UNSENT) != 0
+
+    def content(self, row: int) -> str:
+        """
+            Returns content of message in row (None if it has none).
+        """
+        if not self.flags[row] & HAS_CONTENT:
+            return None
+        start, end = self.content_offsets[row], self.content_offsets[row + 1]
+        return self.content_blob[start:end].tobytes().decode("utf-8")
+
+    def sender_names(self, rows: np.ndarray = None) -> "pd.Categorical":
+        """
+            Returns sender names of rows (all if None) as a pd.Categorical
+            built over the names string table without copying names.
+        """
+        senders = self.sender if rows is None else self.sender[rows]
+        return categorical(senders, self.names)
+
+    def messages_frame(self, columns: list = None) -> "pd.DataFrame":
+        """
+            Returns messages as a pd.DataFrame with the columns of
+            cache.load_messages (all but content and fingerprint if None).
+        """
+        import pandas as pd
+
+        available = {
+            "sender_name": self.sender_names,
+            "timestamp_ms": lambda: self.timestamp_ms,
+            "type": lambda: categorical(self.type, self.types),
+            "is_unsent": lambda: self.is_unsent
+        }
+        columns = columns or list(available)
+        for column in columns:
+            if column not in available:
+                raise ValueError(
+                    f'Bad column parameter provided: {column}. '
+                    f'Please provide one of the valid parameters: [{"|".join(available)}]')
+
+        return pd.DataFrame({column: available[column]() for column in columns})
+
+    def reactions_frame(self, switch: str) -> "pd.DataFrame":
+        """
+            Returns reactions with the columns of cache.load_reactions.
+        """
+        import pandas as pd
+
+        if switch == "sent":
+            participant = categorical(self.reaction_actor, self.names)
+        elif switch == "received":
+            participant = self.sender_names(self.reaction_message)
+        else:
+            raise ValueError(
+                f'Bad switch parameter provided: {switch}. '
+                f'Please provide one of the valid parameters: [sent|received]')
+
+        return pd.DataFrame({
+            "participant": participant,
+            "reaction": categorical(self.reaction, self.reaction_names),
+            "timestamp_ms": self.timestamp_ms[self.reaction_message]
+        })
+
+    def tables(self) -> tuple:
+        """
+            Returns (messages, reactions) tables with the columns
+            rollup.RollupIndex.build reads from cache.load_tables.
+        """
+        import pandas as pd
+
+        reactions = pd.DataFrame({
+            "actor": categorical(self.reaction_actor, self.names),
+            "sender_name": self.sender_names(self.reaction_message),
+            "timestamp_ms": self.timestamp_ms[self.reaction_message]
+        })
+        return self.messages_frame(["sender_name", "timestamp_ms", "is_unsent"]), reactions
+
+
+def open_store(store_path: str) -> Store:
+    """
+        Opens the store written to store_path by write_store.
+    """
+    return Store(store_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Writes a Messenger group chat to a memory-mapped binary store.")
+    parser.add_argument("path", help="relative path to the specific chat folder")
+    parser.add_argument("output", help="store directory to write")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        sys.exit('Provided relative path does not exist.')
+
+    num_messages = write_store(
+        io.iter_group_messages(args.path, deduplicator=io.Deduplicator()), args.output)
+
+    print(f"{num_messages} messages successfully saved to:\n\t{args.output}")
+
+
+if __name__ == "__main__":
+    main()
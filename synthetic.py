@@ -0,0 +1,138 @@
+import argparse
+import json
+import os
+import random
+
+
+# Messenger exports at most this many messages per message_N.json file
+MESSAGES_PER_FILE = 10000
+
+CONTENTS = ["labas", "ok", "haha", "cha cha", "ka veiki?", "žinoma ąčę",
+            "see you tomorrow", "\U0001F606\U0001F606", "gerai, sutarta"]
+
+REACTIONS = ["\U0001F606", "❤", "\U0001F44D", "\U0001F62E", "\U0001F622", "\U0001F620"]
+
+
+def mojibake(text: str) -> str:
+    """
+        Escapes utf-8 text the way Messenger exports do
+        (utf-8 bytes stored as iso-8859-1 characters).
+    """
+    return text.encode("utf-8").decode("iso-8859-1")
+
+
+def generate_messages(participants: list, num_messages: int, years: float,
+                      reaction_rate: float, photo_rate: float, video_rate: float,
+                      call_rate: float, unsent_rate: float, seed: int) -> list:
+    """
+        Returns num_messages random messages of participants spread
+        over years, newest first. The same seed gives the same messages.
+    """
+    rng = random.Random(seed)
+    start = 1325376000000  # 2012-01-01 00:00:00 UTC
+    span = int(years * 365 * 86400000)
+    contents = [mojibake(content) for content in CONTENTS]
+    reactions = [mojibake(reaction) for reaction in REACTIONS]
+    # Reactions are skewed towards the first ones, as in real chats
+    reaction_weights = [2 ** -i for i in range(len(reactions))]
+
+    messages = []
+    for timestamp in sorted((start + rng.randrange(span) for _ in range(num_messages)),
+                            reverse=True):
+        message = {
+            "sender_name": rng.choice(participants),
+            "timestamp_ms": timestamp
+        }
+
+        kind = rng.random()
+        if kind < call_rate:
+            message["call_duration"] = rng.randrange(3600)
+            message["type"] = "Call"
+        elif kind < call_rate + photo_rate:
+            message["photos"] = [{"uri": f"photos/{timestamp}_{i}.jpg",
+                                  "creation_timestamp": timestamp // 1000}
+                                 for i in range(rng.randint(1, 3))]
+            message["type"] = "Generic"
+        elif kind < call_rate + photo_rate + video_rate:
+            message["videos"] = [{"uri": f"videos/{timestamp}.mp4",
+                                  "creation_timestamp": timestamp // 1000}]
+            message["type"] = "Generic"
+        else:
+            message["content"] = rng.choice(contents)
+            message["type"] = "Generic"
+
+        if rng.random() < reaction_rate:
+            actors = rng.sample(participants, rng.randint(1, min(3, len(participants))))
+            message["reactions"] = [{
+                "reaction": rng.choices(reactions, reaction_weights)[0],
+                "actor": actor
+            } for actor in actors]
+
+        if rng.random() < unsent_rate:
+            message["is_unsent"] = True
+
+        messages.append(message)
+
+    return messages
+
+
+def generate_export(folder_path: str, num_participants: int = 5, num_messages: int = 10000,
+                    years: float = 2, reaction_rate: float = 0.3, photo_rate: float = 0.05,
+                    video_rate: float = 0.01, call_rate: float = 0.01,
+                    unsent_rate: float = 0.005, seed: int = 0) -> list:
+    """
+        Writes a synthetic Messenger group chat export to folder_path:
+        message_1.json (newest messages), message_2.json, ... with at most
+        MESSAGES_PER_FILE messages each. Names, content and reactions
+        are escaped as in real exports. The same arguments always give
+        the same files. Returns the list of written file names.
+    """
+    participants = [mojibake(f"Dalyvis {i} Žemė Ąčė")
+                    for i in range(num_participants)]
+    messages = generate_messages(participants, num_messages, years, reaction_rate,
+                                 photo_rate, video_rate, call_rate, unsent_rate, seed)
+
+    os.makedirs(folder_path, exist_ok=True)
+    file_names = []
+
+    for i in range(0, max(len(messages), 1), MESSAGES_PER_FILE):
+        file_name = os.path.join(folder_path, f"message_{i // MESSAGES_PER_FILE + 1}.json")
+        with open(file_name, "w") as outfile:
+            json.dump({
+                "participants": [{"name": name} for name in participants],
+                "messages": messages[i:i + MESSAGES_PER_FILE],
+                "title": mojibake("Sintetinė grupė"),
+                "is_still_participant": True,
+                "thread_type": "RegularGroup",
+                "thread_path": "inbox/synthetic_group"
+            }, outfile, indent=2)
+        file_names.append(file_name)
+
+    return file_names
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generates a synthetic Messenger group chat export.")
+    parser.add_argument("path", help="folder to write message_N.json files to")
+    parser.add_argument("-p", "--participants", type=int, default=5)
+    parser.add_argument("-m", "--messages", type=int, default=10000)
+    parser.add_argument("-y", "--years", type=float, default=2)
+    parser.add_argument("--reactions", type=float, default=0.3,
+                        help="share of messages with reactions")
+    parser.add_argument("--photos", type=float, default=0.05, help="share of photo messages")
+    parser.add_argument("--videos", type=float, default=0.01, help="share of video messages")
+    parser.add_argument("--calls", type=float, default=0.01, help="share of calls")
+    parser.add_argument("--unsent", type=float, default=0.005, help="share of unsent messages")
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    file_names = generate_export(args.path, args.participants, args.messages, args.years,
+                                 args.reactions, args.photos, args.videos, args.calls,
+                                 args.unsent, args.seed)
+
+    print(f"Generated {args.messages} messages in {len(file_names)} files:\n\t{args.path}")
+
+
+if __name__ == "__main__":
+    main()
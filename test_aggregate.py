@@ -0,0 +1,32 @@
+import aggregate
+import synthetic
+
+
+def make_export(folder, monkeypatch):
+    monkeypatch.setattr(synthetic, "MESSAGES_PER_FILE", 500)
+    file_names = synthetic.generate_export(str(folder), num_messages=5000, seed=1)
+    assert len(file_names) == 10
+    return str(folder)
+
+
+def test_parallel_report_matches_serial(tmp_path, monkeypatch):
+    folder = make_export(tmp_path, monkeypatch)
+
+    serial = aggregate.report(folder, workers=1)
+    parallel = aggregate.report(folder, workers=2)
+
+    assert parallel == serial
+    assert serial["messages"]["_total"]["messages"] == 5000
+
+
+def test_parallel_report_keeps_restored_state(tmp_path, monkeypatch):
+    folder = make_export(tmp_path, monkeypatch)
+    results = []
+
+    for workers in (1, 2):
+        metric = aggregate.MessageCounts()
+        metric.load_state({"data": {"X": {"messages": 5}}, "total": {"messages": 5}})
+        results.append(aggregate.report(folder, [metric], workers=workers))
+
+    assert results[1] == results[0]
+    assert results[0]["messages"]["X"]["messages"] == 5
@@ -0,0 +1,45 @@
+import os
+import cache
+
+
+def write_sources(folder):
+    file_names = []
+    for i in range(1, 4):
+        file_name = os.path.join(folder, f"message_{i}.json")
+        with open(file_name, "w") as outfile:
+            outfile.write('{"messages": []}')
+        file_names.append(file_name)
+    return file_names
+
+
+def build(derived_file, file_names):
+    with open(derived_file, "w") as outfile:
+        outfile.write("index")
+    cache.record_sources(derived_file, cache.source_manifest(file_names))
+
+
+def test_sources_unchanged(tmp_path):
+    file_names = write_sources(str(tmp_path))
+    derived_file = str(tmp_path / "index.npz")
+
+    assert not cache.sources_unchanged(derived_file, file_names)
+    build(derived_file, file_names)
+    assert cache.sources_unchanged(derived_file, file_names)
+
+
+def test_deleted_source_is_noticed(tmp_path):
+    file_names = write_sources(str(tmp_path))
+    derived_file = str(tmp_path / "index.npz")
+    build(derived_file, file_names)
+
+    os.remove(file_names[2])
+    assert not cache.sources_unchanged(derived_file, file_names[:2])
+
+
+def test_source_restored_with_older_mtime_is_noticed(tmp_path):
+    file_names = write_sources(str(tmp_path))
+    derived_file = str(tmp_path / "index.npz")
+    build(derived_file, file_names)
+
+    os.utime(file_names[0], (1, 1))
+    assert not cache.sources_unchanged(derived_file, file_names)
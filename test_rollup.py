@@ -0,0 +1,31 @@
+import numpy as np
+import rollup
+
+
+def make_index() -> rollup.RollupIndex:
+    """
+        Returns an index from Monday 2024-01-01 to 2024-01-14 where
+        A sent one message every day, B sent none and only reacted.
+    """
+    counts = np.zeros((len(rollup.METRICS), 2, 14), dtype=np.int64)
+    counts[rollup.METRICS.index("messages"), 0] = 1
+    counts[rollup.METRICS.index("reactions_sent"), 1, 3] = 2
+    cumulative = np.zeros((len(rollup.METRICS), 2, 15), dtype=np.int64)
+    np.cumsum(counts, axis=2, out=cumulative[:, :, 1:])
+    return rollup.RollupIndex(np.datetime64("2024-01-01"), ["A", "B"], cumulative)
+
+
+def test_edge_buckets_only_count_days_in_range():
+    df = make_index().query("messages", "2024-01-03", "2024-01-10", "week")
+
+    assert df["date_local"].dt.strftime("%Y-%m-%d").tolist() == ["2024-01-01", "2024-01-08"]
+    # Wednesday to Sunday of the first week, Monday to Wednesday of the second
+    assert df["count"].tolist() == [5, 3]
+
+
+def test_participants_without_metric_are_left_out():
+    index = make_index()
+
+    assert index.query("messages")["participant"].unique().tolist() == ["A"]
+    assert index.query("reactions_sent")["participant"].unique().tolist() == ["B"]
+    assert index.total("messages", "2024-01-05", "2024-01-06") == {"A": 2, "B": 0}
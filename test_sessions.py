@@ -0,0 +1,32 @@
+import data_io as io
+import sessions
+
+
+def make_timeline(idle_minutes: float = 30) -> sessions.Timeline:
+    # B replies to A after 1 s and after 100 s, A replies to B after 1 s,
+    # then an hour of silence starts a new session.
+    table = io.MessageTable()
+    for sender, timestamp_ms in [("A", 0), ("B", 1000), ("A", 2000), ("B", 102000),
+                                 ("A", 3702000)]:
+        table.append({"sender_name": sender, "timestamp_ms": timestamp_ms})
+    return sessions.Timeline(table, idle_minutes)
+
+
+def test_reply_latency_interpolates_quantiles():
+    df = sessions.reply_latency(make_timeline()).set_index(["replier", "replied_to"])
+
+    assert df.loc[("B", "A"), "replies"] == 2
+    assert df.loc[("B", "A"), "mean_s"] == 50.5
+    assert df.loc[("B", "A"), "median_s"] == 50.5
+    assert abs(df.loc[("B", "A"), "p90_s"] - 90.1) < 1e-9
+    assert df.loc[("A", "B"), "median_s"] == 1.0
+    # The last message starts a new session, so it is not a reply
+    assert df["replies"].sum() == 3
+
+
+def test_sessions_split_on_idle_gaps():
+    timeline = make_timeline()
+
+    assert timeline.session_starts.tolist() == [0, 4]
+    assert sessions.session_starters(timeline) == {"A": 2, "B": 0}
+    assert timeline.sessions(timezone="UTC")["messages"].tolist() == [4, 1]
@@ -0,0 +1,125 @@
+import random
+import numpy as np
+import sketches
+
+
+def zipf_stream(num_items: int = 50000, seed: int = 0) -> list:
+    """
+        Returns a skewed stream of words: word i is about 1 / (i + 1)
+        times as frequent as word 0.
+    """
+    generator = random.Random(seed)
+    weights = [1 / (i + 1) for i in range(2000)]
+    return [f"word{i}" for i in generator.choices(range(2000), weights, k=num_items)]
+
+
+def true_counts(items: list) -> dict:
+    counts = {}
+    for item in items:
+        counts[item] = counts.get(item, 0) + 1
+    return counts
+
+
+def test_hyperloglog_error():
+    sketch = sketches.HyperLogLog()
+    for i in range(100000):
+        sketch.add(f"value{i}")
+
+    # 3 standard errors of 0.81%
+    assert abs(sketch.count() - 100000) <= 0.025 * 100000
+
+
+def test_hyperloglog_merge_equals_single_sketch():
+    single, first, second = sketches.HyperLogLog(), sketches.HyperLogLog(), sketches.HyperLogLog()
+    for i in range(20000):
+        single.add(f"value{i}")
+        (first if i % 2 else second).add(f"value{i}")
+
+    first.merge(second)
+    assert first.count() == single.count()
+
+
+def test_count_min_never_undercounts_and_merges_exactly():
+    items = zipf_stream()
+    counts = true_counts(items)
+    single, first, second = (sketches.CountMinSketch() for _ in range(3))
+    for i, item in enumerate(items):
+        single.add(item)
+        (first if i < len(items) // 2 else second).add(item)
+    first.merge(second)
+
+    assert np.array_equal(first.counts, single.counts)
+    bound = np.e / single.width * single.total
+    for item, count in counts.items():
+        assert count <= single.estimate(item) <= count + bound
+
+
+def check_space_saving(sketch: sketches.SpaceSaving, counts: dict, total: int):
+    kept = {item: (count, error) for item, count, error in sketch.top()}
+    for item, count in counts.items():
+        if count > total / sketch.k:
+            assert item in kept
+    for item, (count, error) in kept.items():
+        # Kept counts overestimate by at most their error, itself at most total / k
+        assert count - error <= counts.get(item, 0) <= count
+        assert error <= total / sketch.k
+
+
+def test_space_saving_keeps_frequent_items():
+    items = zipf_stream()
+    sketch = sketches.SpaceSaving(k=50)
+    for item in items:
+        sketch.add(item)
+
+    assert sketch.total == len(items)
+    check_space_saving(sketch, true_counts(items), len(items))
+
+
+def test_space_saving_merge_of_halves():
+    items = zipf_stream(seed=1)
+    first, second = sketches.SpaceSaving(k=50), sketches.SpaceSaving(k=50)
+    for i, item in enumerate(items):
+        (first if i < len(items) // 2 else second).add(item)
+    first.merge(second)
+
+    assert first.total == len(items)
+    check_space_saving(first, true_counts(items), len(items))
+
+
+def rank_error(values: list, estimate, fraction: float) -> float:
+    """
+        Returns how far (as a fraction of all values) the rank of
+        estimate is from the requested fraction.
+    """
+    values = np.sort(values)
+    low = np.searchsorted(values, estimate, side="left") / len(values)
+    high = np.searchsorted(values, estimate, side="right") / len(values)
+    return max(0.0, low - fraction, fraction - high)
+
+
+def test_kll_rank_error():
+    values = list(range(100000))
+    random.Random(0).shuffle(values)
+    sketch = sketches.KLLSketch()
+    for value in values:
+        sketch.add(value)
+
+    fractions = [0.01, 0.1, 0.5, 0.9, 0.99]
+    for fraction, estimate in zip(fractions, sketch.quantiles(fractions)):
+        # Rank error is about 1.7 / k (0.85% for k = 200)
+        assert rank_error(values, estimate, fraction) <= 0.02
+    assert sketch.size() < sketch.max_size()
+
+
+def test_kll_merge_of_halves():
+    values = list(range(100000))
+    random.Random(1).shuffle(values)
+    first, second = sketches.KLLSketch(), sketches.KLLSketch(seed=1)
+    for i, value in enumerate(values):
+        (first if i < len(values) // 2 else second).add(value)
+    first.merge(second)
+
+    assert first.count == len(values)
+    fractions = [0.1, 0.5, 0.9]
+    for fraction, estimate in zip(fractions, first.quantiles(fractions)):
+        assert rank_error(values, estimate, fraction) <= 0.02
@@ -0,0 +1,44 @@
+import numpy as np
+import data_io as io
+import store
+import synthetic
+
+
+def test_store_round_trip(tmp_path):
+    folder = str(tmp_path / "chat")
+    synthetic.generate_export(folder, num_messages=2000, seed=4)
+    messages = list(io.iter_group_messages(folder))
+
+    assert store.write_store(messages, str(tmp_path / "chat.fbstore")) == len(messages)
+    assert store.is_store(str(tmp_path / "chat.fbstore"))
+    opened = store.open_store(str(tmp_path / "chat.fbstore"))
+
+    assert len(opened) == len(messages)
+    assert [opened.names[i] for i in opened.sender.tolist()] == \
+        [message["sender_name"] for message in messages]
+    assert opened.timestamp_ms.tolist() == [message["timestamp_ms"] for message in messages]
+    assert opened.is_unsent.tolist() == [message.get("is_unsent", False) for message in messages]
+    assert opened.photos.tolist() == [len(message["photos"]) if "photos" in message else -1
+                                      for message in messages]
+    assert [opened.content(row) for row in range(len(opened))] == \
+        [message.get("content") for message in messages]
+
+    reactions = [(row, reaction["actor"], reaction["reaction"])
+                 for row, message in enumerate(messages)
+                 for reaction in message.get("reactions", [])]
+    assert list(zip(opened.reaction_message.tolist(),
+                    [opened.names[i] for i in opened.reaction_actor.tolist()],
+                    [opened.reaction_names[i] for i in opened.reaction.tolist()])) == reactions
+
+
+def test_store_frames_match_cached_columns(tmp_path):
+    folder = str(tmp_path / "chat")
+    synthetic.generate_export(folder, num_messages=500, seed=5)
+    store.write_store(io.iter_group_messages(folder), str(tmp_path / "chat.fbstore"))
+    opened = store.open_store(str(tmp_path / "chat.fbstore"))
+
+    frame = opened.messages_frame()
+    assert list(frame.columns) == ["sender_name", "timestamp_ms", "type", "is_unsent"]
+    assert list(frame["sender_name"].cat.categories) == sorted(opened.names)
+    assert np.array_equal(frame["timestamp_ms"].to_numpy(), opened.timestamp_ms)
+    assert len(opened.reactions_frame("sent")) == len(opened.reaction)
@@ -0,0 +1,281 @@
+import os
+from array import array
+import numpy as np
+import pandas as pd
+import cache
+import data_io as io
+import instrument
+import store
+
+
+# Bumped whenever the layout of the saved index changes.
+INDEX_VERSION = 2
+
+# Posting list deltas are stored in the smallest of these types that fits
+POSTING_TYPES = (np.uint8, np.uint16, np.uint32)
+
+
+class TextIndex():
+    """
+        Inverted index of message content. For every word it keeps the
+        sorted ids (rows) of messages containing it, delta encoded in
+        the smallest unsigned integer type that fits the largest gap.
+        Sender, timestamp and content of each message are kept in
+        columns, so queries never re-read the export.
+    """
+
+    def __init__(self, names: list, sender: np.ndarray, timestamp_ms: np.ndarray,
+                 content_blob: bytes, content_offsets: np.ndarray, terms: list,
+                 term_types: np.ndarray, term_offsets: np.ndarray,
+                 term_lengths: np.ndarray, postings: dict):
+        self.names = list(names)
+        self.sender = sender
+        self.timestamp_ms = timestamp_ms
+        self.content_blob = content_blob
+        self.content_offsets = content_offsets
+        self.terms = list(terms)
+        self.term_index = {term: i for i, term in enumerate(self.terms)}
+        # Posting list of term i is postings[POSTING_TYPES[term_types[i]]]
+        # [term_offsets[i]:term_offsets[i] + term_lengths[i]]; its first item is absolute.
+        self.term_types = term_types
+        self.term_offsets = term_offsets
+        self.term_lengths = term_lengths
+        self.postings = postings
+
+    def __len__(self) -> int:
+        return len(self.sender)
+
+    @classmethod
+    def build(cls, messages) -> "TextIndex":
+        """
+            Builds the index of prepared messages, e.g.
+            data_io.iter_group_messages with a deduplicator.
+        """
+        names, name_index = [], {}
+        sender = array("I")
+        timestamp_ms = array("q")
+        contents = []
+        offsets = array("q", [0])
+        term_postings = {}
+
+        with instrument.stage("build_text_index") as stage:
+            for row, message in enumerate(messages):
+                name = message["sender_name"]
+                if name not in name_index:
+                    name_index[name] = len(names)
+                    names.append(name)
+                sender.append(name_index[name])
+                timestamp_ms.append(message["timestamp_ms"])
+
+                content = message.get("content") or ""
+                encoded = content.encode("utf-8")
+                contents.append(encoded)
+                offsets.append(offsets[-1] + len(encoded))
+
+                for term in set(io.tokenize(content)):
+                    postings = term_postings.get(term)
+                    if postings is None:
+                        postings = term_postings[term] = array("I")
+                    postings.append(row)
+            stage.rows_in = len(sender)
+            stage.rows_out = len(term_postings)
+
+        terms = sorted(term_postings)
+        term_types = np.zeros(len(terms), dtype=np.uint8)
+        term_offsets = np.zeros(len(terms), dtype=np.int64)
+        term_lengths = np.zeros(len(terms), dtype=np.int64)
+        encoded_postings = {dtype: [] for dtype in POSTING_TYPES}
+        sizes = {dtype: 0 for dtype in POSTING_TYPES}
+
+        for i, term in enumerate(terms):
+            rows = np.frombuffer(term_postings[term], dtype=np.uint32)
+            deltas = np.diff(rows, prepend=np.uint32(0))
+            largest = int(deltas.max())
+            kind = next(k for k, dtype in enumerate(POSTING_TYPES)
+                        if largest <= np.iinfo(dtype).max)
+            dtype = POSTING_TYPES[kind]
+            term_types[i] = kind
+            term_offsets[i] = sizes[dtype]
+            term_lengths[i] = len(deltas)
+            encoded_postings[dtype].append(deltas.astype(dtype))
+            sizes[dtype] += len(deltas)
+
+        postings = {dtype: np.concatenate(chunks) if chunks else np.zeros(0, dtype=dtype)
+                    for dtype, chunks in encoded_postings.items()}
+
+        return cls(names, np.frombuffer(sender, dtype=np.uint32).copy(),
+                   np.frombuffer(timestamp_ms, dtype=np.int64).copy(),
+                   b"".join(contents), np.frombuffer(offsets, dtype=np.int64).copy(),
+                   terms, term_types, term_offsets, term_lengths, postings)
+
+    def save(self, file_name: str):
+        """
+            Saves the index to a NumPy .npz file. Names and terms are
+            saved like content, as a utf-8 blob with offsets, since
+            fixed-width string arrays pad every item to the longest one.
+        """
+        names_blob, names_offsets = encode_strings(self.names)
+        terms_blob, terms_offsets = encode_strings(self.terms)
+        np.savez(
+            file_name, version=np.array(INDEX_VERSION),
+            names_blob=names_blob, names_offsets=names_offsets,
+            sender=self.sender, timestamp_ms=self.timestamp_ms,
+            content_blob=np.frombuffer(self.content_blob, dtype=np.uint8),
+            content_offsets=self.content_offsets,
+            terms_blob=terms_blob, terms_offsets=terms_offsets,
+            term_types=self.term_types, term_offsets=self.term_offsets,
+            term_lengths=self.term_lengths,
+            **{f"postings_{np.dtype(dtype).name}": values
+               for dtype, values in self.postings.items()})
+
+    @classmethod
+    def load(cls, file_name: str) -> "TextIndex":
+        """
+            Loads the index saved with save(). Returns None if it was
+            saved by another version.
+        """
+        with np.load(file_name) as data:
+            if int(data["version"]) != INDEX_VERSION:
+                return None
+            return cls(decode_strings(data["names_blob"], data["names_offsets"]),
+                       data["sender"], data["timestamp_ms"],
+                       data["content_blob"].tobytes(), data["content_offsets"],
+                       decode_strings(data["terms_blob"], data["terms_offsets"]),
+                       data["term_types"], data["term_offsets"], data["term_lengths"],
+                       {dtype: data[f"postings_{np.dtype(dtype).name}"]
+                        for dtype in POSTING_TYPES})
+
+    def posting_list(self, term: str) -> np.ndarray:
+        """
+            Returns sorted ids of messages containing term.
+        """
+        i = self.term_index.get(term)
+        if i is None:
+            return np.zeros(0, dtype=np.int64)
+
+        start = self.term_offsets[i]
+        deltas = self.postings[POSTING_TYPES[self.term_types[i]]][
+            start:start + self.term_lengths[i]]
+        return np.cumsum(deltas, dtype=np.int64)
+
+    def content(self, row: int) -> str:
+        return self.content_blob[
+            self.content_offsets[row]:self.content_offsets[row + 1]].decode("utf-8")
+
+    def matches(self, query: str) -> np.ndarray:
+        """
+            Returns sorted ids of messages containing query: a word or a
+            phrase (words in this order next to each other).
+            Case and punctuation are ignored.
+        """
+        words = io.tokenize(query)
+        if not words:
+            return np.zeros(0, dtype=np.int64)
+
+        # Intersect posting lists, shortest first
+        lists = sorted((self.posting_list(word) for word in set(words)), key=len)
+        rows = lists[0]
+        for other in lists[1:]:
+            rows = np.intersect1d(rows, other, assume_unique=True)
+
+        if len(words) == 1:
+            return rows
+
+        # Keep messages where the words are adjacent
+        phrase = tuple(words)
+        return np.array([row for row in rows.tolist()
+                         if contains_phrase(io.tokenize(self.content(row)), phrase)],
+                        dtype=np.int64)
+
+    def count_by_participant(self, query: str) -> dict:
+        """
+            Returns the number of messages of each participant containing query.
+        """
+        counts = np.bincount(self.sender[self.matches(query)], minlength=len(self.names))
+        return dict(zip(self.names, counts.tolist()))
+
+    def count_per_period(self, query: str, period: str = "month",
+                         timezone: str = None) -> pd.DataFrame:
+        """
+            Returns the number of messages containing query per participant
+            and period ["day", "month", "year"] in timezone (local if None)
+            as a participant, date_local, count pd.DataFrame.
+        """
+        rows = self.matches(query)
+        dates = io.truncate_dates(io.to_local_datetime(self.timestamp_ms[rows], timezone), period)
+        df = pd.DataFrame({
+            "participant": np.array(self.names, dtype=object)[self.sender[rows]],
+            "date_local": dates.to_numpy()
+        })
+        return df.groupby(["participant", "date_local"]).size().reset_index(name="count")
+
+
+def encode_strings(strings: list) -> tuple:
+    """
+        Returns strings as (utf-8 blob, offsets), where string i is
+        blob[offsets[i]:offsets[i + 1]].
+    """
+    encoded = [string.encode("utf-8") for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(item) for item in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def decode_strings(blob: np.ndarray, offsets: np.ndarray) -> list:
+    """
+        Returns strings encoded with encode_strings.
+    """
+    data = blob.tobytes()
+    bounds = offsets.tolist()
+    return [data[start:end].decode("utf-8") for start, end in zip(bounds, bounds[1:])]
+
+
+def contains_phrase(words: list, phrase: tuple) -> bool:
+    length = len(phrase)
+    return any(tuple(words[i:i + length]) == phrase for i in range(len(words) - length + 1))
+
+
+def store_messages(message_store: store.Store):
+    """
+        Yields messages of a binary store with the fields TextIndex.build reads.
+    """
+    for row, (sender, timestamp_ms) in enumerate(zip(message_store.sender.tolist(),
+                                                     message_store.timestamp_ms.tolist())):
+        yield {
+            "sender_name": message_store.names[sender],
+            "timestamp_ms": timestamp_ms,
+            "content": message_store.content(row)
+        }
+
+
+def load_index(folder_path: str, cache_dir: str = None) -> TextIndex:
+    """
+        Returns the text index of folder_path (a chat folder or a binary
+        store, see store.py) persisted next to its cached tables.
+        The index is rebuilt if any source file was added, deleted or
+        changed since it was built (see cache.sources_unchanged).
+    """
+    directory = cache.folder_cache_dir(folder_path, cache_dir)
+    index_file = os.path.join(directory, "text_index.npz")
+    sources = io.group_files(folder_path)
+    if store.is_store(folder_path):
+        sources = [os.path.join(folder_path, store.MANIFEST_FILE)]
+
+    if cache.sources_unchanged(index_file, sources):
+        index = TextIndex.load(index_file)
+        if index is not None:
+            return index
+
+    print("Building text index...")
+    # Recorded before building, so files changed meanwhile trigger a rebuild
+    manifest = cache.source_manifest(sources)
+    if store.is_store(folder_path):
+        messages = store_messages(store.open_store(folder_path))
+    else:
+        messages = io.iter_group_messages(folder_path, deduplicator=io.Deduplicator(),
+                                          fields=["sender_name", "timestamp_ms", "content"])
+    index = TextIndex.build(messages)
+    os.makedirs(directory, exist_ok=True)
+    index.save(index_file)
+    cache.record_sources(index_file, manifest)
+    return index